@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+from extract import looks_like_predicate
+from filters import fold, is_excluded, is_fuzzy, normalize
+from matcher import MatchEngine
+from delivery import Delivery
+from pipeline import post_link
+
+# Ключи во временном движке подбора: новый фильтр и прежние фильтры пользователя
+NEW_FILTER, OLD_FILTERS = 0, 1
+
+
+def text_search(user_filter: list[list[str]]) -> str | None:
+    # Для $text берём первую группу из слов: в подходящем посте есть хотя бы одно её слово.
+    # Нечёткие слова и спецсимволы полнотекстовый индекс не найдёт - тогда без сужения.
+    group = next((g for g in user_filter
+                  if not any(is_excluded(w) or looks_like_predicate(w) for w in g)), None)
+    if not group:
+        return None
+    words = []
+    for word in group:
+        if is_fuzzy(word) or not word.strip():
+            return None
+        for variant in normalize(word):
+            variant = fold(variant)
+            if not variant.replace(" ", "").isalnum():
+                return None
+            # Фраза в кавычках сделала бы её обязательной для всех постов: ищем её слова по отдельности
+            words.extend(variant.split())
+    return " ".join(dict.fromkeys(words)) or None
+
+
+class Backfill:
+    # Новый фильтр прогоняется по постам за последние дни: курсор по processed_at (сначала новые),
+    # в памяти только текущая пачка курсора, не больше limit найденных и scan_limit просмотренных
+    def __init__(self, texts_col, delivery_queue, days: int = 3, limit: int = 20,
+                 scan_limit: int = 5000, text_index: bool = False):
+        self.texts_col = texts_col
+        self.delivery_queue = delivery_queue
+        self.days = days
+        self.limit = limit
+        self.scan_limit = scan_limit
+        self.text_index = text_index
+        self._tasks: dict[int, asyncio.Task] = {}
+        self.runs = 0
+        self.scanned = 0
+        self.delivered = 0
+
+    def running(self, user_id: int) -> bool:
+        return user_id in self._tasks
+
+    def start(self, user_id: int, new_filter: list, old_filters: list) -> bool:
+        if user_id in self._tasks:
+            return False
+        task = asyncio.create_task(self._run(user_id, new_filter, old_filters))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+        return True
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, user_id: int, new_filter: list, old_filters: list):
+        try:
+            found = await self.run(user_id, new_filter, old_filters)
+            if not found:
+                await self.delivery_queue.put(Delivery(
+                    chat_id=user_id, from_chat_id=None, message_id=None,
+                    text=f"За последние {self.days} дн. подходящих вакансий не нашлось.",
+                    channel_title=None, post_link=None, user_filter=None
+                ))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка подбора вакансий из истории для {user_id}: {e}")
+
+    async def run(self, user_id: int, new_filter: list, old_filters: list) -> int:
+        self.runs += 1
+        # Новый и прежние фильтры в одном движке: пост разбирается так же, как при рассылке
+        # (окно фраз по самому длинному фильтру, нечёткие слова, условия на поля)
+        engine = MatchEngine(fuzzy_workers=1)
+        engine.set_user_filters(NEW_FILTER, [new_filter])
+        # Посты, подходившие под старые фильтры, пользователь уже получал
+        if old_filters:
+            engine.set_user_filters(OLD_FILTERS, old_filters)
+
+        query = {"processed_at": {"$gte": datetime.datetime.utcnow() - datetime.timedelta(days=self.days)}}
+        search = text_search(new_filter) if self.text_index else None
+        if search:
+            query["$text"] = {"$search": search}
+        cursor = self.texts_col.find(
+            query,
+            {"channel_id": 1, "channel_username": 1, "channel_title": 1, "message_id": 1,
+             "text": 1, "cluster": 1}
+        ).sort("processed_at", -1).limit(self.scan_limit).batch_size(100)
+
+        found = 0
+        async for post in cursor:
+            self.scanned += 1
+            text = post.get("text")
+            if not text or post.get("cluster"):
+                continue
+            matches = engine.match_prepared(engine.prepare(text))
+            if NEW_FILTER not in matches or OLD_FILTERS in matches:
+                continue
+            await self.delivery_queue.put(Delivery(
+                chat_id=user_id,
+                from_chat_id=post["channel_id"],
+                message_id=post["message_id"],
+                text=text,
+                channel_title=post.get("channel_title"),
+                post_link=post_link(post["channel_id"], post.get("channel_username"), post["message_id"]),
+                user_filter=matches[NEW_FILTER]
+            ))
+            found += 1
+            if found >= self.limit:
+                break
+        self.delivered += found
+        return found
+
+    def stats(self) -> dict:
+        return {"running": len(self._tasks), "runs": self.runs, "scanned": self.scanned,
+                "delivered": self.delivered}
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+
+class FakeBotApi:
+    # Bot API на localhost для прогонов с несколькими процессами: на любой метод отвечает ok,
+    # считает вызовы и время первой и последней отправки. Бот подключается через TELEGRAM_API_URL.
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.first_send = None
+        self.last_send = None
+        self._message_ids = 0
+        self._server = None
+
+    @property
+    def sends(self) -> int:
+        return self.calls["forwardMessage"] + self.calls["sendMessage"]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method in ("forwardMessage", "sendMessage"):
+            now = time.perf_counter()
+            self.first_send = self.first_send or now
+            self.last_send = now
+            self._message_ids += 1
+            chat_id = int(params.get("chat_id", 0))
+            return {"message_id": self._message_ids, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}}
+        return True
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # httpx держит соединение открытым: читаем запросы, пока клиент не закроет его
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                length = 0
+                content_type = ""
+                for line in head[1:]:
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                    elif name.lower() == "content-type":
+                        content_type = value.strip()
+                body = await reader.readexactly(length) if length else b""
+                if content_type.startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                method = head[0].split(" ")[1].rstrip("/").rsplit("/", 1)[-1]
+                self.calls[method] += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                payload = json.dumps({"ok": True, "result": self._result(method, params)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
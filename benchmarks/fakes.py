@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import time
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, arg in condition.items():
+                if op == "$exists" and (field in doc) != arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$gte" and (value is None or value < arg):
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class MemoryCursor:
+    def __init__(self, docs: list[dict]):
+        self.docs = docs
+
+    def sort(self, field: str, direction: int = 1):
+        self.docs.sort(key=lambda doc: doc.get(field), reverse=direction < 0)
+        return self
+
+    def limit(self, count: int):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else list(self.docs)
+
+
+class MemoryCollection:
+    # Коллекция MongoDB в памяти: только то, что вызывают модули бота, и уникальность
+    # по ключам, заданным через create_index(..., unique=True)
+    def __init__(self):
+        self.docs: list[dict] = []
+        self.unique: list[tuple[str, ...]] = []
+        self._keys: dict[tuple[str, ...], set] = {}
+        self._ids = itertools.count(1)
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+        if unique and fields not in self.unique:
+            self.unique.append(fields)
+            self._keys[fields] = {tuple(doc.get(f) for f in fields) for doc in self.docs}
+        return "_".join(fields)
+
+    def _insert(self, doc: dict):
+        keys = [(fields, tuple(doc.get(f) for f in fields)) for fields in self.unique]
+        for fields, key in keys:
+            if key in self._keys[fields]:
+                raise DuplicateKeyError(f"E11000 duplicate key {fields}: {key}", 11000)
+        for fields, key in keys:
+            self._keys[fields].add(key)
+        doc.setdefault("_id", next(self._ids))
+        self.docs.append(doc)
+
+    async def insert_one(self, doc: dict):
+        self._insert(doc)
+
+    async def insert_many(self, docs: list[dict], ordered: bool = True):
+        errors = []
+        for i, doc in enumerate(docs):
+            try:
+                self._insert(doc)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    async def find_one(self, query: dict | None = None, projection=None):
+        for doc in self.docs:
+            if _matches(doc, query or {}):
+                return doc
+        return None
+
+    def find(self, query: dict | None = None, projection=None) -> MemoryCursor:
+        return MemoryCursor([doc for doc in self.docs if _matches(doc, query or {})])
+
+    async def count_documents(self, query: dict) -> int:
+        return sum(1 for doc in self.docs if _matches(doc, query))
+
+
+class FakeBot:
+    # Бот без сети: запоминает время первой доставки каждого поста
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+        self.first_delivery: dict[tuple[int, int], float] = {}
+
+    async def _call(self, key):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        self.first_delivery.setdefault(key, time.perf_counter())
+
+    async def forward_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call((from_chat_id, message_id))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call((chat_id, None))
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from channels import ChannelRegistry
+from dedup import RecentKeys, NearDuplicateIndex
+from delivery import DeliveryQueue
+from filters import highlight, prepare_text
+from matcher import MatchEngine
+from pipeline import IngestPipeline, IncomingPost
+from registry import SubscriberRegistry
+from storage import PostStore
+from benchmarks.fakes import FakeBot, MemoryCollection
+from benchmarks.synthetic import generate_channels, generate_filters, generate_posts
+
+SCENARIOS = ("build_index", "prepare", "match", "match_loop", "highlight", "channel_lookup", "end_to_end")
+
+# Исходный алгоритм из filters.py до индекса: синонимы раскрываются на каждый вызов,
+# слова ищутся подстрокой в тексте поста. Копия нужна, чтобы базовая линия не менялась вместе с filters.py
+LEGACY_SYNONYMS = {
+    "питон": ["python"],
+    "дистанционно": ["удаленно", "удалённо", "remote"],
+    "без опыта": ["junior", "начинающий", "intern"],
+    "офис": ["офисе", "офиса"],
+    "гибрид": ["гибридно", "hybrid"],
+    "стажировка": ["internship", "стажёр"],
+    "зарплата": ["оплата", "salary", "зп"],
+    "fullstack": ["full stack", "фулстек"],
+    "backend": ["бэкенд", "бекенд"],
+    "frontend": ["фронтенд"]
+}
+
+
+def legacy_normalize(word: str):
+    word = word.lower().strip()
+    return list(set([word] + LEGACY_SYNONYMS.get(word, [])))
+
+
+def legacy_text_matches_filters(text: str, filters: list[list[str]]) -> bool:
+    text = text.lower()
+    return all(
+        any(variant.lower() in text for word in group for variant in legacy_normalize(word))
+        for group in filters
+    )
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples: list[float], elapsed: float, items: int) -> dict:
+    return {
+        "items": items,
+        "per_sec": items / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def timed(func, items) -> tuple[list[float], float]:
+    samples = []
+    started = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - t)
+    return samples, time.perf_counter() - started
+
+
+class Workload:
+    def __init__(self, args):
+        self.args = args
+        self.posts = generate_posts(args.posts, seed=args.seed)
+        self.filters = generate_filters(args.users, args.filters, args.words, seed=args.seed + 1)
+        self.channels = generate_channels(args.channels)
+        self._engine = None
+
+    @property
+    def engine(self) -> MatchEngine:
+        if self._engine is None:
+            self._engine = MatchEngine(fuzzy_workers=1)
+            self._engine.set_many(self.filters.items())
+        return self._engine
+
+
+def bench_build_index(work: Workload):
+    engine = MatchEngine(fuzzy_workers=1)
+    items = list(work.filters.items())
+    samples, elapsed = timed(lambda item: engine.set_user_filters(*item), items)
+    return summarize(samples, elapsed, len(items))
+
+
+def bench_prepare(work: Workload):
+    samples, elapsed = timed(prepare_text, work.posts)
+    return summarize(samples, elapsed, len(work.posts))
+
+
+def bench_match(work: Workload):
+    engine = work.engine
+    samples, elapsed = timed(engine.match, work.posts)
+    result = summarize(samples, elapsed, len(work.posts))
+    result["recipients_per_post"] = sum(len(engine.match(p)) for p in work.posts[:200]) / min(200, len(work.posts))
+    return result
+
+
+def bench_match_loop(work: Workload):
+    # Прежний путь: перебор всех пользователей и их фильтров на каждый пост исходным алгоритмом
+    def match(text):
+        for filters_list in work.filters.values():
+            for user_filter in filters_list:
+                if legacy_text_matches_filters(text, user_filter):
+                    break
+
+    posts = work.posts[:work.args.loop_posts]
+    samples, elapsed = timed(match, posts)
+    return summarize(samples, elapsed, len(posts))
+
+
+def bench_highlight(work: Workload):
+    # Отрисовка запасного уведомления для каждого получателя поста
+    engine = work.engine
+    pairs = [(text, list(engine.match(text).values())) for text in work.posts]
+
+    def render(pair):
+        text, compiled = pair
+        for user_filter in compiled:
+            highlight(text, user_filter)
+
+    samples, elapsed = timed(render, pairs)
+    result = summarize(samples, elapsed, len(pairs))
+    result["renders"] = sum(len(c) for _, c in pairs)
+    return result
+
+
+def bench_channel_lookup(work: Workload):
+    registry = ChannelRegistry(None)
+    for channel in work.channels:
+        registry.add(channel)
+    lookups = []
+    for i in range(len(work.posts)):
+        channel = work.channels[i % len(work.channels)]
+        kind = i % 20
+        if kind < 12:
+            lookups.append((channel["channel_id"], channel["channel_username"], channel["channel_title"]))
+        elif kind < 16:
+            lookups.append((0, channel["channel_username"].upper(), channel["channel_title"]))
+        elif kind < 19:
+            lookups.append((0, None, channel["channel_title"]))
+        else:
+            lookups.append((0, "@unknown", "Неизвестный канал"))
+    samples, elapsed = timed(lambda args: registry.lookup(*args), lookups)
+    return summarize(samples, elapsed, len(lookups))
+
+
+async def _end_to_end(work: Workload):
+    args = work.args
+    posts_col = MemoryCollection()
+    texts_col = MemoryCollection()
+    users_col = MemoryCollection()
+    await posts_col.create_index([("channel_id", 1), ("message_id", 1)], unique=True)
+    await texts_col.create_index([("channel_id", 1), ("message_id", 1)], unique=True)
+    for user_id, filters_list in work.filters.items():
+        await users_col.insert_one({"user_id": user_id, "filters_list": filters_list})
+
+    subscribers = SubscriberRegistry(users_col, MatchEngine(fuzzy_workers=1))
+    await subscribers.load()
+    bot = FakeBot(latency=args.send_latency_ms / 1000)
+    delivery_queue = DeliveryQueue(
+        lambda delivery: delivery.text,
+        workers=args.delivery_workers,
+        maxsize=0,
+        global_rate=1e9,
+        chat_rate=1e9
+    )
+    pipeline = IngestPipeline(
+        PostStore(posts_col, texts_col, codec=args.compression), subscribers, delivery_queue,
+        RecentKeys(), NearDuplicateIndex(),
+        window=args.batch_window_ms / 1000, max_size=args.batch_size, maxsize=0
+    )
+    delivery_queue.start(bot)
+    pipeline.start()
+
+    submitted = {}
+    interval = 1 / args.rate if args.rate else 0
+    started = time.perf_counter()
+    for i, text in enumerate(work.posts):
+        channel = work.channels[i % len(work.channels)]
+        key = (channel["channel_id"], i + 1)
+        submitted[key] = time.perf_counter()
+        await pipeline.submit(IncomingPost(
+            channel["channel_id"], channel["channel_username"], channel["channel_title"], i + 1, text
+        ))
+        if interval:
+            await asyncio.sleep(interval)
+        elif i % args.batch_size == 0:
+            await asyncio.sleep(0)
+
+    # Пачка завершена, когда записана её полная задержка
+    while (pipeline.depth() or pipeline.posts + pipeline.duplicates < len(work.posts)
+           or pipeline.stage_latency["total"].count < pipeline.batches):
+        await asyncio.sleep(0.001)
+    await delivery_queue.queue.join()
+    elapsed = time.perf_counter() - started
+    await pipeline.stop()
+    await delivery_queue.stop()
+
+    samples = [bot.first_delivery[key] - t for key, t in submitted.items() if key in bot.first_delivery]
+    result = summarize(samples, elapsed, len(work.posts))
+    result["notifications"] = bot.sent
+    result["notifications_per_sec"] = bot.sent / elapsed
+    return result
+
+
+def bench_end_to_end(work: Workload):
+    return asyncio.run(_end_to_end(work))
+
+
+def measure(name: str, work: Workload, memory: bool) -> dict:
+    func = globals()[f"bench_{name}"]
+    result = func(work)
+    if memory:
+        # Отдельный прогон под tracemalloc, чтобы трассировка не искажала время
+        tracemalloc.start()
+        func(work)
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    print(f"\nСравнение с базовой линией ({baseline.get('created_at', '?')}):")
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in (("per_sec", True), ("p99_ms", False), ("peak_mb", False)):
+            if metric not in result or not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            mark = " <-- регрессия" if worse > tolerance else ""
+            print(f"  {name:15} {metric:8} {base[metric]:12.3f} -> {result[metric]:12.3f} ({change:+.1%}){mark}")
+            if metric == "per_sec" and worse > tolerance:
+                regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк сопоставления, подсветки и рассылки")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--filters", type=int, default=5, help="фильтров на пользователя")
+    parser.add_argument("--words", type=int, default=3, help="слов в фильтре")
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--loop-posts", type=int, default=20, help="постов для прежнего перебора")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--rate", type=float, default=0, help="постов в секунду в end_to_end, 0 - всё сразу")
+    parser.add_argument("--batch-window-ms", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--delivery-workers", type=int, default=8)
+    parser.add_argument("--send-latency-ms", type=float, default=0)
+    parser.add_argument("--compression", choices=("zlib", "zstd"), help="сжатие текста в end_to_end")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память")
+    parser.add_argument("--save", help="сохранить результаты как базовую линию (JSON)")
+    parser.add_argument("--compare", help="сравнить с сохранённой базовой линией")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    work = Workload(args)
+    results = {}
+    for name in args.scenarios:
+        result = results[name] = measure(name, work, not args.no_memory)
+        memory = f"{result['peak_mb']:8.1f} MB" if "peak_mb" in result else ""
+        print(f"{name:15} {result['per_sec']:12.1f}/s  p50 {result['p50_ms']:8.3f} ms  "
+              f"p99 {result['p99_ms']:8.3f} ms {memory}")
+    if results.get("match_loop", {}).get("per_sec") and "match" in results:
+        results["match"]["speedup"] = results["match"]["per_sec"] / results["match_loop"]["per_sec"]
+        print(f"Индекс быстрее прежнего перебора в {results['match']['speedup']:.1f} раз")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Регрессия пропускной способности: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from motor.motor_asyncio import AsyncIOMotorClient
+from pipeline import IncomingPost
+from storage import PostStore
+from benchmarks.fake_api import FakeBotApi
+from benchmarks.synthetic import generate_channels, generate_filters, generate_posts
+
+# Прогон режима воркеров: локальный mongod (MONGO_URI), Bot API на localhost и N процессов
+# `bot.py --role worker`. Посты пишутся в базу так же, как их сохраняет приёмный процесс.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def seed(db, args):
+    for name in ("users", "posts", "post_texts", "outbox", "delivered", "leases"):
+        await db[name].drop()
+    filters = generate_filters(args.users, args.filters, args.words, seed=args.seed + 1)
+    await db.users.insert_many(
+        [{"user_id": user_id, "filters_list": filters_list} for user_id, filters_list in filters.items()]
+    )
+    await db.posts.create_index([("channel_id", 1), ("message_id", 1)], unique=True)
+    await db.post_texts.create_index([("channel_id", 1), ("message_id", 1)], unique=True)
+
+
+def spawn_workers(count: int, args) -> list[subprocess.Popen]:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "1:fake",
+        "MONGO_DB": args.db,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}/bot",
+        "WORKER_SHARDS": str(args.shards),
+        "LEASE_TTL": "6",
+        "WORKER_POLL_INTERVAL": "0.2",
+        "DELIVERY_WORKERS": str(args.delivery_workers),
+        "DELIVERY_GLOBAL_RATE": "1000000",
+        "DELIVERY_CHAT_RATE": "1000000",
+        "FUZZY_WORKERS": "1",
+        "METRICS_PORT": "0",
+    }
+    return [
+        subprocess.Popen([sys.executable, "bot.py", "--role", "worker"], cwd=ROOT,
+                         env={**env, "WORKER_ID": f"scale-{i}"}, stdout=subprocess.DEVNULL)
+        for i in range(count)
+    ]
+
+
+async def wait_balanced(db, workers: int, shards: int, timeout: float) -> bool:
+    # Шарды поделены между всеми воркерами, у каждого не больше ceil(shards / workers)
+    limit = -(-shards // workers)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        owners = [doc.get("owner") async for doc in db.leases.find({"kind": "shard"}, {"owner": 1})]
+        held = {owner: owners.count(owner) for owner in set(owners) if owner}
+        if sum(held.values()) == shards and len(held) == workers and max(held.values()) <= limit:
+            return True
+        await asyncio.sleep(0.5)
+    return False
+
+
+async def run_once(workers: int, args) -> dict:
+    db = AsyncIOMotorClient(os.getenv("MONGO_URI"))[args.db]
+    await seed(db, args)
+    api = await FakeBotApi(latency=args.latency_ms / 1000).start(port=args.api_port)
+    processes = spawn_workers(workers, args)
+    try:
+        if not await wait_balanced(db, workers, args.shards, timeout=args.balance_timeout):
+            print(f"{workers} воркеров: шарды не распределились за {args.balance_timeout} с")
+        store = PostStore(db.posts, db.post_texts)
+        channels = generate_channels(args.channels)
+        posts = []
+        for i, text in enumerate(generate_posts(args.posts, seed=args.seed)):
+            channel = channels[i % len(channels)]
+            posts.append(IncomingPost(channel["channel_id"], channel["channel_username"],
+                                      channel["channel_title"], i + 1, text))
+        for i in range(0, len(posts), 100):
+            batch = posts[i:i + 100]
+            records = [store.record(post) for post in batch]
+            await db.posts.insert_many(records, ordered=False)
+            await store.save_texts(batch, records)
+
+        # Рассылка закончилась, когда отправки перестали приходить
+        sends = -1
+        while sends != api.sends or not sends:
+            sends = api.sends
+            await asyncio.sleep(args.idle)
+        elapsed = (api.last_send - api.first_send) or 1e-9
+        return {"workers": workers, "sends": sends, "elapsed": elapsed, "per_sec": sends / elapsed}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        await api.stop()
+
+
+async def run(args):
+    baseline = None
+    for workers in args.workers:
+        result = await run_once(workers, args)
+        baseline = baseline or result["per_sec"] / workers
+        print(f"{workers:3} воркеров: {result['sends']:7} отправок за {result['elapsed']:6.2f} с  "
+              f"{result['per_sec']:9.1f}/с  (x{result['per_sec'] / baseline:.2f} к одному воркеру)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Масштабирование рассылки по процессам-воркерам")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--filters", type=int, default=3, help="фильтров на пользователя")
+    parser.add_argument("--words", type=int, default=3, help="слов в фильтре")
+    parser.add_argument("--posts", type=int, default=300)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--delivery-workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20, help="задержка ответа Bot API")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--db", default="devradar_scale")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--balance-timeout", type=float, default=60)
+    parser.add_argument("--idle", type=float, default=3, help="секунд без отправок до конца прогона")
+    args = parser.parse_args(argv)
+    if not os.getenv("MONGO_URI"):
+        print("Нужен MONGO_URI локального mongod")
+        return 1
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
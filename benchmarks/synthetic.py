@@ -0,0 +1,95 @@
+import random
+
+ROLES_RU = ["разработчик", "программист", "инженер", "аналитик", "тестировщик", "дизайнер",
+            "менеджер проекта", "тимлид", "архитектор", "системный администратор"]
+ROLES_EN = ["developer", "engineer", "analyst", "QA engineer", "designer", "project manager",
+            "team lead", "architect", "data scientist", "DevOps engineer"]
+STACK = ["Python", "Django", "FastAPI", "Go", "Java", "Kotlin", "C++", "C#", ".NET", "JavaScript",
+         "TypeScript", "React", "Vue", "Node.js", "PostgreSQL", "MongoDB", "Redis", "Kafka", "Docker",
+         "Kubernetes", "AWS", "Linux", "Swift", "PHP", "Laravel", "Rust", "Scala", "1С", "SQL",
+         "Spark", "Airflow", "Terraform", "Flutter", "Unity"]
+LEVELS = ["junior", "middle", "senior", "lead", "стажёр", "джуниор", "мидл", "сеньор"]
+FORMATS = ["удалённо", "удаленная работа", "офис", "гибрид", "релокация", "полная занятость",
+           "частичная занятость", "remote", "full-time", "part-time"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Минск",
+          "Алматы", "Тбилиси", "Белград", "Берлин"]
+
+TEMPLATES_RU = [
+    "Ищем {level} {role} в продуктовую команду.",
+    "Требования: опыт работы с {stack} от {years} лет, знание {stack2}.",
+    "Условия: {format}, зарплата от {salary} ₽, ДМС и обучение за счёт компании.",
+    "Будет плюсом опыт с {stack} и {stack2}.",
+    "Город: {city}. Возможен {format}.",
+    "Задачи: разработка и поддержка сервисов на {stack}, код-ревью, участие в архитектурных решениях.",
+    "Откликаться в личные сообщения @hr_{years}{salary}.",
+    "#вакансия #{tag} #{level}",
+]
+TEMPLATES_EN = [
+    "We are hiring a {level} {role} to join our team.",
+    "Requirements: {years}+ years of commercial experience with {stack}, good knowledge of {stack2}.",
+    "We offer: {format}, salary from ${salary}, paid vacation and equipment.",
+    "Nice to have: {stack} and {stack2} in production.",
+    "Location: {city} or {format}.",
+    "Send your CV to jobs{years}@example.com",
+    "#job #{tag} #{level}",
+]
+
+
+def _fill(rng: random.Random, template: str, english: bool) -> str:
+    stack = rng.choice(STACK)
+    return template.format(
+        level=rng.choice(LEVELS),
+        role=rng.choice(ROLES_EN if english else ROLES_RU),
+        stack=stack,
+        stack2=rng.choice(STACK),
+        format=rng.choice(FORMATS),
+        city=rng.choice(CITIES),
+        years=rng.randint(1, 6),
+        salary=rng.randrange(50, 500, 10) * 1000 if not english else rng.randrange(1, 12) * 1000,
+        tag=stack.lower().replace(".", "").replace("+", "p").replace("#", "sharp"),
+    )
+
+
+def generate_post(rng: random.Random, english_share: float = 0.3, sentences: tuple[int, int] = (4, 8)) -> str:
+    english = rng.random() < english_share
+    templates = TEMPLATES_EN if english else TEMPLATES_RU
+    count = rng.randint(*sentences)
+    lines = [_fill(rng, templates[0], english)]
+    lines.extend(_fill(rng, rng.choice(templates[1:]), english) for _ in range(count - 1))
+    return "\n".join(lines)
+
+
+def generate_posts(count: int, seed: int = 1, english_share: float = 0.3) -> list[str]:
+    rng = random.Random(seed)
+    return [generate_post(rng, english_share) for _ in range(count)]
+
+
+def generate_filter(rng: random.Random, words: int) -> list[list[str]]:
+    pools = [STACK, LEVELS, ROLES_RU + ROLES_EN, FORMATS, CITIES]
+    chosen = []
+    for pool in rng.sample(pools, min(words, len(pools))):
+        chosen.append(rng.choice(pool).lower())
+    while len(chosen) < words:
+        chosen.append(rng.choice(STACK).lower())
+    return [[word] for word in chosen]
+
+
+def generate_filters(users: int, filters_per_user: int, words_per_filter: int,
+                     seed: int = 2) -> dict[int, list]:
+    # Фильтры в том же виде, что хранятся в users.filters_list
+    rng = random.Random(seed)
+    return {
+        user_id: [generate_filter(rng, words_per_filter) for _ in range(filters_per_user)]
+        for user_id in range(1, users + 1)
+    }
+
+
+def generate_channels(count: int) -> list[dict]:
+    return [
+        {
+            "channel_id": -1001000000000 - i,
+            "channel_username": f"@jobs_channel_{i}",
+            "channel_title": f"Вакансии IT #{i}",
+        }
+        for i in range(count)
+    ]
@@ -1,19 +1,42 @@
 import os
 import asyncio
-import re
+import html
+import signal
+import socket
+import time
 import datetime
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, Chat
+from telegram import (Bot, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, Chat,
+                      InlineKeyboardButton, InlineKeyboardMarkup)
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, 
+    CallbackQueryHandler,
     CommandHandler, 
     MessageHandler, 
     filters, 
     ContextTypes,
-    ConversationHandler
+    ConversationHandler,
+    TypeHandler
 )
 from dotenv import load_dotenv
-from db import posts_col, users_col, channels_col
-from filters import text_matches_filters, normalize
+from db import (posts_col, post_texts_col, users_col, channels_col, digests_col, outbox_col, ledger_col,
+                leases_col, keyword_stats_col, ensure_indexes, collection_stats)
+from extract import looks_like_predicate, parse_predicate
+from filters import highlight, bare_word, format_group, is_excluded, parse_group, FUZZY_MARKER
+from sharding import create_match_engine
+from updates import OrderedApplication, InstrumentedRequest
+from metrics import histogram, errors, filter_checks, serve_prometheus, ENABLED as METRICS_ENABLED
+from registry import SubscriberRegistry
+from delivery import Delivery, DeliveryQueue, NO_FORWARD_TTL
+from channels import ChannelRegistry, paginate
+from dedup import RecentKeys, NearDuplicateIndex
+from pipeline import IngestPipeline, IncomingPost
+from digest import DigestStore, DIGEST_MODES, INSTANT
+from backfill import Backfill
+from storage import PostStore
+from outbox import Outbox
+from workers import ShardLeases, ShardWorker
+from keyword_stats import KeywordStats
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -30,12 +53,296 @@ print(f"Загружены ID администраторов: {ADMIN_IDS}")
 if not ADMIN_IDS:
     print("ADMIN_IDS не найдены в .env файле!")
 
+REGISTRY_RESYNC_INTERVAL = int(os.getenv("REGISTRY_RESYNC_INTERVAL", "600"))
+REGISTRY_CHANGE_STREAM = os.getenv("REGISTRY_CHANGE_STREAM", "0") == "1"
+# Как часто подтягивать изменения пользователей, записанные другими процессами (по updated_at)
+REGISTRY_REFRESH_INTERVAL = float(os.getenv("REGISTRY_REFRESH_INTERVAL", "5"))
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "10000"))
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "25"))
+DELIVERY_CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", "1"))
+FUZZY_SCORE_CUTOFF = int(os.getenv("FUZZY_SCORE_CUTOFF", "80"))
+FUZZY_WORKERS = int(os.getenv("FUZZY_WORKERS", "-1"))
+CHANNELS_REFRESH_INTERVAL = int(os.getenv("CHANNELS_REFRESH_INTERVAL", "600"))
+RECENT_POSTS_CACHE_SIZE = int(os.getenv("RECENT_POSTS_CACHE_SIZE", "10000"))
+NEAR_DUP_WINDOW_HOURS = float(os.getenv("NEAR_DUP_WINDOW_HOURS", "72"))
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.7"))
+INGEST_BATCH_WINDOW_MS = int(os.getenv("INGEST_BATCH_WINDOW_MS", "200"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+MATCH_BACKEND = os.getenv("MATCH_BACKEND", "inloop")
+MATCH_SHARDS = int(os.getenv("MATCH_SHARDS", str(os.cpu_count() or 1)))
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+DIGEST_DAILY_HOUR = int(os.getenv("DIGEST_DAILY_HOUR", "9"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "50"))
+BACKFILL_DAYS = int(os.getenv("BACKFILL_DAYS", "3"))
+BACKFILL_LIMIT = int(os.getenv("BACKFILL_LIMIT", "20"))
+BACKFILL_SCAN_LIMIT = int(os.getenv("BACKFILL_SCAN_LIMIT", "5000"))
+BACKFILL_TEXT_INDEX = os.getenv("BACKFILL_TEXT_INDEX", "0") == "1"
+POST_TEXT_TTL_DAYS = int(os.getenv("POST_TEXT_TTL_DAYS", "14"))
+POST_TEXT_COMPRESSION = os.getenv("POST_TEXT_COMPRESSION", "")
+POST_ARCHIVE_DAYS = int(os.getenv("POST_ARCHIVE_DAYS", "0"))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "21600"))
+LEDGER_TTL_DAYS = int(os.getenv("LEDGER_TTL_DAYS", "7"))
+LEDGER_BLOOM_CAPACITY = int(os.getenv("LEDGER_BLOOM_CAPACITY", "1000000"))
+OUTBOX_FLUSH_INTERVAL = float(os.getenv("OUTBOX_FLUSH_INTERVAL", "1.0"))
+BOT_ROLE = os.getenv("BOT_ROLE", "all")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_SHARDS = int(os.getenv("WORKER_SHARDS", "16"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "0.5"))
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+KEYWORD_STATS_DAYS = int(os.getenv("KEYWORD_STATS_DAYS", "14"))
+KEYWORD_STATS_INTERVAL = int(os.getenv("KEYWORD_STATS_INTERVAL", "600"))
+KEYWORD_STATS_MIN_POSTS = int(os.getenv("KEYWORD_STATS_MIN_POSTS", "200"))
+
 ASK_COUNT, ASK_WORDS = range(2)
 MANAGE_FILTERS, DELETE_FILTER = range(2, 4)
 ADD_CHANNEL_INPUT = 5
 CONFIRM_CHANNEL = 6
 MAX_FILTERS = 10
 ADD_CHANNEL = 5
+CHANNELS_PAGE_SIZE = 20
+MESSAGE_LIMIT = 4000
+
+def render_notification(delivery: Delivery) -> str:
+    # Запасной вариант, если переслать пост не получилось
+    highlighted_text = highlight(delivery.text, delivery.user_filter)
+    channel_title = html.escape(delivery.channel_title or "", quote=False)
+    return (f"🔔 <b>Новый пост в канале {channel_title}</b>\n\n"
+            f"{highlighted_text}\n\n"
+            f"<a href='{delivery.post_link}'>Ссылка на пост</a>")
+
+# Движок сопоставления выбирается в main(): процессы шардов нельзя запускать при импорте
+subscribers = SubscriberRegistry(users_col)
+tracked_channels = ChannelRegistry(channels_col)
+recent_posts = RecentKeys(RECENT_POSTS_CACHE_SIZE)
+near_duplicates = NearDuplicateIndex(
+    window=NEAR_DUP_WINDOW_HOURS * 3600,
+    threshold=NEAR_DUP_THRESHOLD
+)
+async def mark_channel_restricted(channel_id: int):
+    # Запоминаем в базе, чтобы после перезапуска не тратить на канал неудачную пересылку
+    await channels_col.update_one(
+        {"channel_id": channel_id},
+        {"$set": {"forwardable": False, "restricted_at": datetime.datetime.utcnow()}}
+    )
+
+outbox = Outbox(
+    outbox_col,
+    ledger_col,
+    bloom_capacity=LEDGER_BLOOM_CAPACITY,
+    flush_interval=OUTBOX_FLUSH_INTERVAL
+)
+delivery_queue = DeliveryQueue(
+    render_notification,
+    workers=DELIVERY_WORKERS,
+    maxsize=DELIVERY_QUEUE_SIZE,
+    global_rate=DELIVERY_GLOBAL_RATE,
+    chat_rate=DELIVERY_CHAT_RATE,
+    on_blocked=subscribers.deactivate,
+    on_restricted=mark_channel_restricted,
+    outbox=outbox
+)
+subscribers.on_reactivated = delivery_queue.unblock
+post_store = PostStore(
+    posts_col,
+    post_texts_col,
+    codec=POST_TEXT_COMPRESSION or None,
+    archive_days=POST_ARCHIVE_DAYS
+)
+digests = DigestStore(digests_col, max_items=DIGEST_MAX_ITEMS)
+keyword_stats = KeywordStats(keyword_stats_col, window_days=KEYWORD_STATS_DAYS, min_posts=KEYWORD_STATS_MIN_POSTS)
+ingest_pipeline = IngestPipeline(
+    post_store,
+    subscribers,
+    delivery_queue,
+    recent_posts,
+    near_duplicates,
+    window=INGEST_BATCH_WINDOW_MS / 1000,
+    max_size=INGEST_BATCH_SIZE,
+    maxsize=INGEST_QUEUE_SIZE,
+    digests=digests,
+    outbox=outbox,
+    keyword_stats=keyword_stats
+)
+backfill = Backfill(
+    post_texts_col,
+    delivery_queue,
+    days=BACKFILL_DAYS,
+    limit=BACKFILL_LIMIT,
+    scan_limit=BACKFILL_SCAN_LIMIT,
+    text_index=BACKFILL_TEXT_INDEX
+)
+api_request = InstrumentedRequest(connection_pool_size=256) if METRICS_ENABLED else None
+handler_latency = {stage: histogram() for stage in ("lookup", "submit")}
+metrics_server = None
+
+def check_stats() -> dict:
+    checked = filter_checks["filters"]
+    return {
+        "filters_checked": checked,
+        "groups_per_filter": filter_checks["groups"] / checked if checked else 0.0,
+        "verified_candidates": getattr(subscribers.engine, "verified", 0),
+    }
+
+def collect_stats() -> dict:
+    return {
+        "handler": {f"{stage}_latency": h.snapshot() for stage, h in handler_latency.items()},
+        "pipeline": ingest_pipeline.stats(),
+        "delivery": delivery_queue.stats(),
+        "subscribers": subscribers.stats(),
+        "channels": {"tracked": len(tracked_channels), "hits": tracked_channels.hits,
+                     "rejected": tracked_channels.rejected},
+        "outbox": outbox.stats(),
+        "digest": digests.stats(),
+        "backfill": backfill.stats(),
+        "storage": post_store.stats(),
+        "keywords": {**keyword_stats.stats(), **check_stats()},
+        "dedup": {"recent_posts": len(recent_posts), "near_duplicates": near_duplicates.duplicates,
+                  "skipped_sends": near_duplicates.skipped_sends},
+        "api": api_request.stats() if api_request else {},
+        "errors": dict(errors),
+    }
+
+async def resync_subscribers(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await subscribers.resync()
+    except Exception as e:
+        errors["resync"] += 1
+        print(f"Ошибка сверки кэша пользователей: {e}")
+
+async def refresh_subscribers(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await subscribers.refresh()
+    except Exception as e:
+        errors["resync"] += 1
+        print(f"Ошибка обновления кэша пользователей: {e}")
+
+async def refresh_channels(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await tracked_channels.load()
+    except Exception as e:
+        errors["channels_refresh"] += 1
+        print(f"Ошибка обновления списка каналов: {e}")
+
+async def send_digests(context: ContextTypes.DEFAULT_TYPE):
+    mode = context.job.data
+    try:
+        sent = await digests.flush(mode, delivery_queue)
+        if sent:
+            print(f"Отправлено дайджестов ({mode}): {sent}")
+    except Exception as e:
+        errors["digest"] += 1
+        print(f"Ошибка рассылки дайджестов ({mode}): {e}")
+
+async def apply_retention(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        archived, stripped = await post_store.purge(POST_TEXT_TTL_DAYS)
+        if archived or stripped:
+            print(f"Хранение постов: удалён сжатый текст у {archived}, ужато старых записей {stripped}")
+    except Exception as e:
+        errors["retention"] += 1
+        print(f"Ошибка очистки старых постов: {e}")
+
+async def update_keyword_stats(reorder):
+    # Счётчики этого процесса - в базу, частоты за окно по всем процессам - в порядок групп фильтров
+    try:
+        await keyword_stats.flush()
+        await keyword_stats.load()
+        reorder(keyword_stats.frequencies())
+    except Exception as e:
+        errors["keyword_stats"] += 1
+        print(f"Ошибка обновления статистики ключевых слов: {e}")
+
+async def refresh_keyword_stats(context: ContextTypes.DEFAULT_TYPE):
+    await update_keyword_stats(subscribers.reorder)
+
+def restore_restrictions():
+    now = datetime.datetime.utcnow()
+    for channel in tracked_channels.all():
+        if channel.get("forwardable") is False and channel.get("restricted_at"):
+            ttl = NO_FORWARD_TTL - (now - channel["restricted_at"]).total_seconds()
+            if ttl > 0:
+                delivery_queue.restrict_channel(channel["channel_id"], ttl)
+
+async def on_startup(app: Application):
+    global metrics_server
+    await ensure_indexes(text_index=BACKFILL_TEXT_INDEX, text_ttl_days=POST_TEXT_TTL_DAYS,
+                         ledger_ttl_days=LEDGER_TTL_DAYS, keyword_stats_days=KEYWORD_STATS_DAYS)
+    # Частоты нужны до загрузки фильтров: индекс сразу строится по самым редким группам
+    await update_keyword_stats(subscribers.reorder)
+    await subscribers.load()
+    await near_duplicates.load(posts_col)
+    await tracked_channels.load()
+    restore_restrictions()
+    delivery_queue.blocked = set(subscribers.inactive)
+    await outbox.load()
+    outbox.start()
+    delivery_queue.start(app.bot)
+    if ingest_pipeline.routing:
+        # Сначала незавершённая рассылка, потом посты, не дошедшие до outbox
+        await outbox.resume(delivery_queue, post_store)
+        await ingest_pipeline.recover()
+    ingest_pipeline.start()
+    if REGISTRY_CHANGE_STREAM:
+        app.create_task(subscribers.watch())
+    else:
+        # Блокировки, найденные воркерами шардов, без change stream
+        app.job_queue.run_repeating(
+            refresh_subscribers,
+            interval=REGISTRY_REFRESH_INTERVAL,
+            first=REGISTRY_REFRESH_INTERVAL
+        )
+    app.job_queue.run_repeating(
+        resync_subscribers,
+        interval=REGISTRY_RESYNC_INTERVAL,
+        first=REGISTRY_RESYNC_INTERVAL
+    )
+    app.job_queue.run_repeating(
+        refresh_channels,
+        interval=CHANNELS_REFRESH_INTERVAL,
+        first=CHANNELS_REFRESH_INTERVAL
+    )
+    app.job_queue.run_repeating(send_digests, interval=3600, first=3600, data="hourly")
+    app.job_queue.run_repeating(apply_retention, interval=RETENTION_INTERVAL, first=60)
+    app.job_queue.run_repeating(
+        refresh_keyword_stats,
+        interval=KEYWORD_STATS_INTERVAL,
+        first=KEYWORD_STATS_INTERVAL
+    )
+    app.job_queue.run_daily(send_digests, time=datetime.time(hour=DIGEST_DAILY_HOUR), data="daily")
+    if METRICS_PORT:
+        metrics_server = await serve_prometheus(collect_stats, METRICS_HOST, METRICS_PORT)
+        print(f"Метрики Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def on_shutdown(app: Application):
+    await backfill.stop()
+    await ingest_pipeline.stop()
+    await keyword_stats.flush()
+    await delivery_queue.stop()
+    await outbox.stop()
+    subscribers.engine.close()
+    if metrics_server:
+        metrics_server.close()
+
+async def reactivate_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Пользователь снова пишет боту после блокировки: возвращаем его в рассылку
+    user = update.effective_user
+    if not user or not update.effective_chat or update.effective_chat.type != Chat.PRIVATE:
+        return
+    if user.id in subscribers.inactive:
+        delivery_queue.unblock(user.id)
+        await subscribers.reactivate(user.id)
+        print(f"Пользователь {user.id} снова активен")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -57,6 +364,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/add_filter - добавить фильтр для поиска\n"
         "/manage - управление фильтрами\n"
         "/channels - список отслеживаемых каналов\n"
+        "/digest - уведомления сразу или дайджестом\n"
         "/help - помощь и инструкции\n\n"
         "Начни с команды /add_filter чтобы создать свой первый фильтр!"
     )
@@ -70,9 +378,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def add_filter_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data = await users_col.find_one({"user_id": user_id})
+    filters_list = subscribers.get_filters(user_id)
+    if filters_list is None:
+        user_data = await users_col.find_one({"user_id": user_id})
+        filters_list = user_data.get("filters_list", []) if user_data else []
     
-    if user_data and len(user_data.get("filters_list", [])) >= MAX_FILTERS:
+    if len(filters_list) >= MAX_FILTERS:
         await update.message.reply_text(
             "Достигнут лимит в 10 фильтров. Удалите старые фильтры командой /manage",
             reply_markup=ReplyKeyboardRemove()
@@ -112,8 +423,11 @@ async def ask_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     word_text = "слово" if count == 1 else "слова"
     await update.message.reply_text(
-        f"Введите {count} {word_text} для фильтра через запятую:",
-        reply_markup=ReplyKeyboardRemove()
+        f"Введите {count} {word_text} для фильтра через запятую:\n\n"
+        "<i>Начните строку с ~, чтобы фильтр прощал опечатки (например: ~python, бэкенд)\n"
+        "Варианты через |, исключения с минусом: python|go, удалённо, -senior</i>",
+        reply_markup=ReplyKeyboardRemove(),
+        parse_mode='HTML'
     )
     return ASK_WORDS
 
@@ -125,7 +439,9 @@ async def save_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Ошибка! Начните снова командой /start")
         return ConversationHandler.END
     
-    words = [w.strip() for w in update.message.text.split(",")]
+    text = update.message.text.strip()
+    fuzzy = text.startswith(FUZZY_MARKER)
+    words = [w.strip() for w in text.removeprefix(FUZZY_MARKER).split(",")]
     
     if len(words) != count:
         await update.message.reply_text(
@@ -133,39 +449,88 @@ async def save_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ASK_WORDS
     
-    new_filter = [[word] for word in words]
+    # Каждое слово - группа: «python|go» - любое из слов, «-senior» или «-senior|lead» - ни одного
+    new_filter = [parse_group(word, fuzzy) for word in words]
+    if None in new_filter:
+        word = words[new_filter.index(None)]
+        await update.message.reply_text(
+            f"Не понял «{word}». Варианты пишите через |, а минус ставьте перед всей группой: "
+            "python|go, -senior|lead. Попробуйте еще раз:"
+        )
+        return ASK_WORDS
+    if all(is_excluded(w) for group in new_filter for w in group):
+        await update.message.reply_text(
+            "В фильтре должно быть хотя бы одно слово без минуса. Попробуйте еще раз:"
+        )
+        return ASK_WORDS
+    
+    invalid = [bare_word(w) for group in new_filter for w in group
+               if looks_like_predicate(bare_word(w)) and parse_predicate(bare_word(w)) is None]
+    if invalid:
+        await update.message.reply_text(
+            f"Не понял условие «{invalid[0]}». Примеры: salary>=150k, format=remote, "
+            "level=junior, stack=python. Попробуйте еще раз:"
+        )
+        return ASK_WORDS
     
     await users_col.update_one(
         {"user_id": user_id},
-        {"$push": {"filters_list": {"$each": [new_filter], "$slice": -MAX_FILTERS}}},
+        {"$push": {"filters_list": {"$each": [new_filter], "$slice": -MAX_FILTERS}},
+         "$set": {"updated_at": datetime.datetime.utcnow()}},
         upsert=True
     )
     
     user_data = await users_col.find_one({"user_id": user_id})
     filter_count = len(user_data.get("filters_list", []))
+    subscribers.update_user(user_id, user_data.get("filters_list", []), user_data["_id"])
     
-    await update.message.reply_text(
-        f"✅ Фильтр добавлен! Всего фильтров: {filter_count}/{MAX_FILTERS}\n"
-        "Используйте /manage для управления фильтрами"
-    )
+    reply = (f"✅ Фильтр добавлен! Всего фильтров: {filter_count}/{MAX_FILTERS}\n"
+             "Используйте /manage для управления фильтрами")
+    if BACKFILL_DAYS:
+        reply += f"\n\nПрислать подходящие вакансии за последние {BACKFILL_DAYS} дн.? /backfill"
+    await update.message.reply_text(reply)
     
     return ConversationHandler.END
 
+async def backfill_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not BACKFILL_DAYS:
+        await update.message.reply_text("Подбор вакансий из истории отключён.")
+        return
+
+    filters_list = subscribers.get_filters(user_id)
+    if filters_list is None:
+        user_data = await users_col.find_one({"user_id": user_id})
+        filters_list = user_data.get("filters_list") if user_data else None
+    if not filters_list:
+        await update.message.reply_text("Сначала добавьте фильтр командой /add_filter")
+        return
+
+    # Проверяем только последний добавленный фильтр
+    if not backfill.start(user_id, filters_list[-1], filters_list[:-1]):
+        await update.message.reply_text("⏳ Подбор уже идёт, подождите немного.")
+        return
+    await update.message.reply_text(
+        f"🔎 Ищу вакансии за последние {BACKFILL_DAYS} дн. по последнему фильтру "
+        f"(не больше {BACKFILL_LIMIT})..."
+    )
+
 async def manage_filters(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
-        user_data = await users_col.find_one({"user_id": user_id})
+        filters = subscribers.get_filters(user_id)
+        if filters is None:
+            user_data = await users_col.find_one({"user_id": user_id})
+            filters = user_data.get("filters_list") if user_data else None
         
-        if not user_data or not user_data.get("filters_list"):
+        if not filters:
             await update.message.reply_text("У вас нет сохраненных фильтров.")
             return ConversationHandler.END
         
-        filters = user_data["filters_list"]
         response = ["📋 Ваши фильтры:"]
         
         for i, f in enumerate(filters, 1):
-            words = [group[0] for group in f]
-            response.append(f"{i}. {', '.join(words)}")
+            response.append(f"{i}. {', '.join(format_group(group) for group in f)}")
         
         response.append("\nОтправьте номер фильтра для удаления или /cancel для отмены")
         await update.message.reply_text("\n".join(response))
@@ -203,12 +568,41 @@ async def delete_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await users_col.update_one(
         {"user_id": user_id},
-        {"$set": {"filters_list": filters}}
+        {"$set": {"filters_list": filters, "updated_at": datetime.datetime.utcnow()}}
     )
+    subscribers.update_user(user_id, filters)
     
     await update.message.reply_text(f"Фильтр #{filter_num} удален!")
     return ConversationHandler.END
 
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    modes = {"hourly": "раз в час", "daily": f"раз в сутки ({DIGEST_DAILY_HOUR}:00 UTC)", INSTANT: "сразу"}
+    if not context.args:
+        current = subscribers.modes.get(user_id, INSTANT)
+        await update.message.reply_text(
+            f"Сейчас вакансии приходят: {modes[current]}.\n\n"
+            "/digest hourly - дайджест раз в час\n"
+            "/digest daily - дайджест раз в сутки\n"
+            "/digest off - присылать каждую вакансию сразу"
+        )
+        return
+
+    mode = context.args[0].lower()
+    if mode == "off":
+        mode = INSTANT
+    if mode not in (INSTANT, *DIGEST_MODES):
+        await update.message.reply_text("Использование: /digest hourly | daily | off")
+        return
+
+    await users_col.update_one(
+        {"user_id": user_id},
+        {"$set": {"delivery_mode": mode, "updated_at": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+    subscribers.set_mode(user_id, mode)
+    await update.message.reply_text(f"✅ Теперь вакансии будут приходить {modes[mode]}.")
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Действие отменено", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
@@ -224,120 +618,114 @@ async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE
         channel_username = f"@{chat.username}" if chat.username else None
         channel_title = chat.title
 
-        channel_in_db = await channels_col.find_one({
-            "$or": [
-                {"channel_id": channel_id},
-                {"channel_username": channel_username},
-                {"channel_title": channel_title}
-            ]
-        })
+        started = time.monotonic()
+        channel_in_db = tracked_channels.lookup(channel_id, channel_username, channel_title)
+        handler_latency["lookup"].observe(time.monotonic() - started)
         
         if not channel_in_db:
             print(f"Пост из неподдерживаемого канала: {channel_title} (ID: {channel_id}, {channel_username})")
             return
 
-        text = channel_post.text
-        message_id = channel_post.message_id
-
-        exists = await posts_col.find_one({"channel_id": channel_id, "message_id": message_id})
-        if exists:
-            return
+        if channel_post.has_protected_content and delivery_queue.restrict_channel(channel_id):
+            await mark_channel_restricted(channel_id)
 
-        await posts_col.insert_one({
-            "channel_id": channel_id,
-            "channel_username": channel_username,
-            "channel_title": channel_title,
-            "message_id": message_id,
-            "text": text,
-            "processed_at": datetime.datetime.utcnow()
-        })
-
-        if channel_username:
-            username = channel_username.lstrip('@')
-            post_link = f"https://t.me/{username}/{message_id}"
-        else:
-            channel_id_num = str(channel_id).replace('-100', '')
-            post_link = f"https://t.me/c/{channel_id_num}/{message_id}"
-
-        async for user in users_col.find({}):
-            if "filters_list" not in user:
-                continue
-                
-            for user_filter in user["filters_list"]:
-                try:
-                    if text_matches_filters(text, user_filter):
-                        try:
-                            await context.bot.forward_message(
-                                chat_id=user["user_id"],
-                                from_chat_id=channel_id,
-                                message_id=message_id
-                            )
-                        except Exception as e:
-                            print(f"Не удалось переслать сообщение пользователю {user['user_id']}: {e}")
-                            highlighted_text = text
-                            for group in user_filter:
-                                for word in group:
-                                    for variant in normalize(word):
-                                        if variant.lower() in text.lower():
-                                            pattern = re.compile(re.escape(variant), re.IGNORECASE)
-                                            highlighted_text = pattern.sub(f'<b>{variant}</b>', highlighted_text)
-                            
-                            await context.bot.send_message(
-                                chat_id=user["user_id"],
-                                text=(f"🔔 <b>Новый пост в канале {channel_title}</b>\n\n"
-                                      f"{highlighted_text}\n\n"
-                                      f"<a href='{post_link}'>Ссылка на пост</a>"),
-                                parse_mode='HTML',
-                                disable_web_page_preview=True
-                            )
-                        break
-                except Exception as e:
-                    print(f"Ошибка при обработке фильтра для пользователя {user['user_id']}: {e}")
-                    continue
+        started = time.monotonic()
+        await ingest_pipeline.submit(IncomingPost(
+            channel_id=channel_id,
+            channel_username=channel_username,
+            channel_title=channel_title,
+            message_id=channel_post.message_id,
+            text=channel_post.text
+        ))
+        handler_latency["submit"].observe(time.monotonic() - started)
                     
     except Exception as e:
+        errors["channel_post"] += 1
         print(f"Критическая ошибка в handle_channel_post: {e}")
 
-async def list_tracked_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    channels = []
-    async for channel in channels_col.find({}):
-        channel_title = channel.get("channel_title", "Без названия")
-        channel_id = channel.get("channel_id", "N/A")
-        username = channel.get("channel_username")
-        added_date = channel.get("added_at", datetime.datetime.utcnow())
-        
-        formatted_date = added_date.strftime("%d.%m.%Y")
-        
-        if username:
-            clean_username = username.lstrip('@')
-            channel_str = (
-                f"• <a href='https://t.me/{clean_username}'>{channel_title}</a> "
-                f"(@{clean_username})\n"
-                f"<i>Добавлен: {formatted_date}</i>"
-            )
-        else:
-            if f"ID: {channel_id}" in channel_title:
-                display_text = channel_title
-            else:
-                display_text = f"{channel_title} (ID: {channel_id})"
-                
-            channel_str = (
-                f"• {display_text}\n"
-                f"<i>Добавлен: {formatted_date}</i>"
-            )
-        
-        channels.append(channel_str)
+def render_tracked_channel(channel: dict) -> str:
+    channel_title = html.escape(channel.get("channel_title") or "Без названия", quote=False)
+    channel_id = channel.get("channel_id", "N/A")
+    username = channel.get("channel_username")
+    added_date = channel.get("added_at", datetime.datetime.utcnow())
+    
+    formatted_date = added_date.strftime("%d.%m.%Y")
     
-    if channels:
-        response = (
-            f"📢 <b>Каналы, отслеживаемые ботом:</b>\n\n" +
-            "\n\n".join(channels) +
-            f"\n\nВсего каналов: <b>{len(channels)}</b>"
+    if username:
+        clean_username = username.lstrip('@')
+        return (
+            f"• <a href='https://t.me/{clean_username}'>{channel_title}</a> "
+            f"(@{clean_username})\n"
+            f"<i>Добавлен: {formatted_date}</i>"
         )
+    if f"ID: {channel_id}" in channel_title:
+        display_text = channel_title
     else:
-        response = "ℹ️ Нет отслеживаемых каналов"
-    
-    await update.message.reply_text(response, parse_mode='HTML', disable_web_page_preview=True)
+        display_text = f"{channel_title} (ID: {channel_id})"
+    return (
+        f"• {display_text}\n"
+        f"<i>Добавлен: {formatted_date}</i>"
+    )
+
+def render_admin_channel(channel: dict) -> str:
+    return (
+        f"📢 {html.escape(channel.get('channel_title') or 'Без названия', quote=False)}\n"
+        f"ID: {channel['channel_id']}\n"
+        f"Username: {channel.get('channel_username') or 'отсутствует'}\n"
+        f"Добавлен: {channel.get('added_at', 'неизвестно')}"
+    )
+
+# Представление каталога каналов: заголовок, строка канала, текст для пустого списка
+CHANNEL_VIEWS = {
+    "tracked": ("📢 <b>Каналы, отслеживаемые ботом:</b>", render_tracked_channel, "ℹ️ Нет отслеживаемых каналов"),
+    "admin": ("📢 <b>Добавленные каналы:</b>", render_admin_channel, "ℹ️ Нет добавленных каналов."),
+}
+
+def build_channel_pages(view: str, channels: list[dict]) -> list[tuple[str, InlineKeyboardMarkup | None]]:
+    header, render, empty = CHANNEL_VIEWS[view]
+    if not channels:
+        return [(empty, None)]
+    footer = f"\n\nВсего каналов: <b>{len(channels)}</b>"
+    bodies = paginate([render(channel) for channel in channels], CHANNELS_PAGE_SIZE,
+                      MESSAGE_LIMIT - len(header) - len(footer) - 2)
+    pages = []
+    for i, body in enumerate(bodies):
+        markup = None
+        if len(bodies) > 1:
+            markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("◀️", callback_data=f"channels:{view}:{(i - 1) % len(bodies)}"),
+                InlineKeyboardButton(f"{i + 1}/{len(bodies)}", callback_data="channels:noop"),
+                InlineKeyboardButton("▶️", callback_data=f"channels:{view}:{(i + 1) % len(bodies)}"),
+            ]])
+        pages.append((f"{header}\n\n{body}{footer}", markup))
+    return pages
+
+def channel_page(view: str, page: int = 0) -> tuple[str, InlineKeyboardMarkup | None]:
+    # Страницы собираются один раз и живут в ChannelRegistry до изменения списка каналов
+    pages = tracked_channels.cached(view, lambda channels: build_channel_pages(view, channels))
+    return pages[min(max(page, 0), len(pages) - 1)]
+
+async def list_tracked_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text, markup = channel_page("tracked")
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=markup, disable_web_page_preview=True)
+
+async def channels_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, view, *page = query.data.split(":")
+    if view not in CHANNEL_VIEWS or not page:
+        await query.answer()
+        return
+    if view == "admin" and query.from_user.id not in ADMIN_IDS:
+        await query.answer("У вас нет прав для выполнения этой команды.")
+        return
+    text, markup = channel_page(view, int(page[0]))
+    await query.answer()
+    try:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=markup, disable_web_page_preview=True)
+    except BadRequest as e:
+        # Страница не изменилась (повторное нажатие)
+        if "not modified" not in str(e):
+            raise
 
 
 async def add_channel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -493,13 +881,15 @@ async def force_add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("ℹ️ Этот канал уже добавлен.")
             return
         
-        await channels_col.insert_one({
+        channel = {
             "channel_id": channel_id,
             "channel_username": channel_username,
             "channel_title": channel_title,
             "added_by": user_id,
             "added_at": datetime.datetime.utcnow()
-        })
+        }
+        await channels_col.insert_one(channel)
+        tracked_channels.add(channel)
         
         await update.message.reply_text(f"Канал добавлен! Название: {channel_title}")
     except ValueError:
@@ -525,13 +915,15 @@ async def confirm_channel_addition(update: Update, context: ContextTypes.DEFAULT
             await update.message.reply_text("Этот канал уже добавлен в систему.")
             return ConversationHandler.END
         
-        await channels_col.insert_one({
+        channel = {
             "channel_id": channel_info["id"],
             "channel_username": channel_info["username"],
             "channel_title": channel_info["title"],
             "added_by": update.effective_user.id,
             "added_at": datetime.datetime.utcnow()
-    })
+        }
+        await channels_col.insert_one(channel)
+        tracked_channels.add(channel)
         
         await update.message.reply_text(
             f"Канал успешно добавлен!\n"
@@ -549,21 +941,8 @@ async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас нет прав для выполнения этой команды.")
         return
 
-    channels = []
-    async for channel in channels_col.find({}):
-        channels.append(
-            f"📢 {channel.get('channel_title', 'Без названия')}\n"
-            f"ID: {channel['channel_id']}\n"
-            f"Username: {channel.get('channel_username', 'отсутствует')}\n"
-            f"Добавлен: {channel.get('added_at', 'неизвестно')}"
-        )
-
-    if not channels:
-        await update.message.reply_text("ℹ️ Нет добавленных каналов.")
-        return
-
-    response = "📢 <b>Добавленные каналы:</b>\n\n" + "\n\n".join(channels)
-    await update.message.reply_text(response, parse_mode='HTML')
+    text, markup = channel_page("admin")
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=markup)
 
 async def delete_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMIN_IDS:
@@ -578,12 +957,109 @@ async def delete_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         channel_id = int(context.args[0])
         result = await channels_col.delete_one({"channel_id": channel_id})
         if result.deleted_count > 0:
+            tracked_channels.remove(channel_id)
             await update.message.reply_text(f"Канал с ID {channel_id} удален.")
         else:
             await update.message.reply_text(f"Канал с ID {channel_id} не найден.")
     except ValueError:
         await update.message.reply_text("Неверный формат ID канала. Должен быть числом.")
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    def fmt(key, value):
+        if isinstance(value, float):
+            return f"{value:.4g}"
+        if isinstance(value, dict) and "p50" in value:
+            if key == "batch_size":
+                return f"n={value['count']} avg={value['avg']:.1f} p50={value['p50']} p99={value['p99']}"
+            return (f"n={value['count']} avg={value['avg'] * 1000:.1f}мс "
+                    f"p50={value['p50'] * 1000:.0f}мс p99={value['p99'] * 1000:.0f}мс")
+        if isinstance(value, dict):
+            return ", ".join(f"{k}={v}" for k, v in value.items()) or "-"
+        return str(value)
+
+    sections = []
+    for section, values in collect_stats().items():
+        body = "\n".join(f"{key}: {fmt(key, value)}" for key, value in values.items()) or "-"
+        sections.append(f"<b>{section}</b>\n<pre>{html.escape(body, quote=False)}</pre>")
+    if not METRICS_ENABLED:
+        sections.append("ℹ️ Гистограммы отключены (METRICS_ENABLED=0)")
+    # Лимит сообщения 4096 символов: режем по границам секций, чтобы не разорвать теги
+    messages = ["📊 <b>Статистика</b>\n"]
+    for section in sections:
+        if len(messages[-1]) + len(section) > 4000:
+            messages.append("")
+        messages[-1] += "\n" + section
+    for text in messages:
+        await update.message.reply_text(text, parse_mode='HTML')
+
+def format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+async def keywords_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    posts = keyword_stats.posts
+    rare, common = keyword_stats.report(subscribers.vocabulary)
+    if not rare:
+        await update.message.reply_text("У пользователей нет фильтров с ключевыми словами.")
+        return
+
+    def lines(items):
+        return "\n".join(
+            f"{html.escape(key, quote=False)}: {count} ({count / posts:.1%})" if posts else
+            f"{html.escape(key, quote=False)}: {count}"
+            for key, count in items
+        )
+
+    checks = check_stats()
+    if keyword_stats.frequencies():
+        ordered = "по частотам"
+    else:
+        ordered = f"в порядке пользователя (нужно {KEYWORD_STATS_MIN_POSTS} постов)"
+    text = (
+        f"🔑 <b>Ключевые слова фильтров</b>\n"
+        f"Постов за {KEYWORD_STATS_DAYS} дн.: {posts}, ключей в фильтрах: {len(subscribers.vocabulary)}\n\n"
+        f"<b>Самые избирательные</b>\n<pre>{lines(rare)}</pre>\n"
+        f"<b>Самые частые</b>\n<pre>{lines(common)}</pre>\n"
+        f"Группы проверяются {ordered}\n"
+        f"Проверено фильтров: {checks['filters_checked']}, "
+        f"в среднем групп на фильтр: {checks['groups_per_filter']:.2f}"
+    )
+    await update.message.reply_text(text, parse_mode='HTML')
+
+async def db_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("У вас нет прав для выполнения этой команды.")
+        return
+
+    stats = await collection_stats()
+    if not stats:
+        await update.message.reply_text("Не удалось получить статистику базы.")
+        return
+
+    lines = ["🗄 <b>Размер коллекций</b>\n"]
+    for name, col in stats.items():
+        lines.append(
+            f"<b>{name}</b>: {col['count']} док., данные {format_size(col['size'])}, "
+            f"на диске {format_size(col['storage_size'])}, индексы {format_size(col['index_size'])}"
+        )
+        for index, size in col["indexes"].items():
+            lines.append(f"   • {html.escape(index)}: {format_size(size)}")
+    ttl = f"{POST_TEXT_TTL_DAYS} дн." if POST_TEXT_TTL_DAYS else "без ограничения"
+    archive = f"{POST_ARCHIVE_DAYS} дн." if POST_ARCHIVE_DAYS else "без ограничения"
+    lines.append(f"\nТексты постов хранятся: {ttl}; сжатый архив ({post_store.codec or 'выключен'}): {archive}")
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
         "🆘 <b>Помощь по использованию бота DevRadar</b>\n\n"
@@ -595,21 +1071,111 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - начать работу с ботом\n"
         "/add_filter - добавить новый фильтр\n"
         "/manage - управление вашими фильтрами\n"
-        "/channels - список отслеживаемых каналов\n\n"
+        "/channels - список отслеживаемых каналов\n"
+        "/digest - уведомления сразу или дайджестом (hourly / daily / off)\n"
+        "/backfill - вакансии за последние дни по новому фильтру\n\n"
         "⚙️ <b>Ограничения:</b>\n"
         "• Максимум 10 фильтров\n"
         "• В каждом фильтре от 1 до 10 слов\n\n"
         "💡 <b>Советы:</b>\n"
         "• Используйте конкретные ключевые слова\n"
+        "• Слова ищутся целиком с учётом окончаний: «офис» найдёт «в офисе», но не «офисный»\n"
         "• Разделяйте слова запятыми при добавлении фильтра\n"
+        "• Начните список слов с ~, чтобы фильтр находил слова с опечатками\n"
+        "• Через | перечисляйте варианты (python|go), а слово с минусом (-senior) "
+        "отсекает посты, где оно есть\n"
+        "• Условия на вакансию: salary&gt;=150k, format=remote, level=junior, stack=python "
+        "(зарплата сравнивается в своей валюте, по умолчанию в рублях)\n"
         "• Комбинируйте технологии и условия работы\n\n"
         "Если у вас остались вопросы, обратитесь к администратору: @oksyol | @tozhest"
     )
     
     await update.message.reply_text(help_text, parse_mode='HTML')
 
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+async def run_worker():
+    # Процесс-воркер без приёма апдейтов: сопоставляет новые посты и рассылает их своим шардам пользователей
+    global metrics_server
+    bot = Bot(BOT_TOKEN, base_url=TELEGRAM_API_URL, request=api_request)
+    worker = ShardWorker(
+        ShardLeases(leases_col, WORKER_ID, WORKER_SHARDS, ttl=LEASE_TTL),
+        users_col,
+        post_store,
+        delivery_queue,
+        outbox,
+        digests,
+        engine_options={"fuzzy_cutoff": FUZZY_SCORE_CUTOFF, "fuzzy_workers": FUZZY_WORKERS},
+        near_dup_options={"window": NEAR_DUP_WINDOW_HOURS * 3600, "threshold": NEAR_DUP_THRESHOLD},
+        batch_size=INGEST_BATCH_SIZE,
+        poll_interval=WORKER_POLL_INTERVAL,
+        resync_interval=REGISTRY_RESYNC_INTERVAL,
+        refresh_interval=REGISTRY_REFRESH_INTERVAL
+    )
+    delivery_queue.on_blocked = worker.deactivate
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass
+
+    async def refresh_keyword_stats_forever():
+        while True:
+            await asyncio.sleep(KEYWORD_STATS_INTERVAL)
+            await update_keyword_stats(worker.reorder)
+
+    async with bot:
+        await ensure_indexes(text_index=BACKFILL_TEXT_INDEX, text_ttl_days=POST_TEXT_TTL_DAYS,
+                             ledger_ttl_days=LEDGER_TTL_DAYS, keyword_stats_days=KEYWORD_STATS_DAYS)
+        await update_keyword_stats(worker.reorder)
+        keyword_stats_task = asyncio.create_task(refresh_keyword_stats_forever())
+        await tracked_channels.load()
+        restore_restrictions()
+        await outbox.load()
+        outbox.start()
+        delivery_queue.start(bot)
+        worker.start()
+        if METRICS_PORT:
+            metrics_server = await serve_prometheus(
+                lambda: {"worker": worker.stats(), "delivery": delivery_queue.stats(),
+                         "outbox": outbox.stats(), "errors": dict(errors)},
+                METRICS_HOST, METRICS_PORT
+            )
+        print(f"Воркер {WORKER_ID} запущен, шардов пользователей: {WORKER_SHARDS}")
+        try:
+            await stopping.wait()
+        finally:
+            keyword_stats_task.cancel()
+            await worker.stop()
+            await outbox.stop()
+            if metrics_server:
+                metrics_server.close()
+
+def main(match_backend: str = MATCH_BACKEND, match_shards: int = MATCH_SHARDS, mode: str = BOT_MODE,
+         role: str = BOT_ROLE):
+    if role == "worker":
+        asyncio.run(run_worker())
+        return
+    if role == "ingress":
+        # Посты только сохраняются, сопоставление и рассылка - в процессах-воркерах
+        ingest_pipeline.routing = False
+
+    subscribers.engine = create_match_engine(
+        match_backend,
+        match_shards,
+        fuzzy_cutoff=FUZZY_SCORE_CUTOFF,
+        fuzzy_workers=FUZZY_WORKERS
+    )
+    print(f"Сопоставление фильтров: {match_backend}" + (f", шардов: {match_shards}" if match_backend == "sharded" else ""))
+
+    builder = (Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL)
+               .post_init(on_startup).post_shutdown(on_shutdown))
+    if api_request:
+        builder = builder.request(api_request)
+    if mode == "webhook":
+        # Апдейты обрабатываются параллельно, но по порядку внутри каждого чата
+        builder = builder.application_class(OrderedApplication).concurrent_updates(CONCURRENT_UPDATES)
+    app = builder.build()
     
     add_filter_conv = ConversationHandler(
         entry_points=[CommandHandler("add_filter", add_filter_start)],
@@ -640,26 +1206,51 @@ def main():
         fallbacks=[CommandHandler("cancel", cancel)]
     )
     
+    app.add_handler(TypeHandler(Update, reactivate_user), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(add_filter_conv)
     app.add_handler(CommandHandler("channels", list_tracked_channels))
     app.add_handler(manage_conv)
     app.add_handler(CommandHandler("list_channels", list_channels))
+    app.add_handler(CallbackQueryHandler(channels_page_callback, pattern=r"^channels:"))
     app.add_handler(CommandHandler("delete_channel", delete_channel))
     app.add_handler(CommandHandler("force_add_channel", force_add_channel))
     app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("digest", digest_command))
+    app.add_handler(CommandHandler("backfill", backfill_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("db_stats", db_stats_command))
+    app.add_handler(CommandHandler("keywords", keywords_command))
     app.add_handler(add_channel_conv)
     app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, handle_channel_post))
     
-    print("Бот запущен...")
-    app.run_polling()
+    if mode == "webhook":
+        print(f"Бот запущен (webhook {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}, параллельно до {CONCURRENT_UPDATES})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        print("Бот запущен...")
+        app.run_polling()
 
 if __name__ == "__main__":
     import platform
     import asyncio
     import datetime
+    import argparse
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--match-backend", choices=("inloop", "sharded"), default=MATCH_BACKEND)
+    parser.add_argument("--match-shards", type=int, default=MATCH_SHARDS)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=BOT_MODE)
+    parser.add_argument("--role", choices=("all", "ingress", "worker"), default=BOT_ROLE)
+    args = parser.parse_args()
     
     if platform.system() == "Windows":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
-    main()
\ No newline at end of file
+    main(args.match_backend, args.match_shards, args.mode, args.role)
\ No newline at end of file
@@ -0,0 +1,74 @@
+def paginate(items: list[str], page_size: int, max_chars: int, separator: str = "\n\n") -> list[str]:
+    # Не больше page_size элементов и max_chars символов на страницу (лимит сообщения Telegram)
+    pages, page, length = [], [], 0
+    for item in items:
+        added = len(item) + (len(separator) if page else 0)
+        if page and (len(page) >= page_size or length + added > max_chars):
+            pages.append(separator.join(page))
+            page, length = [], 0
+            added = len(item)
+        page.append(item)
+        length += added
+    if page:
+        pages.append(separator.join(page))
+    return pages
+
+
+class ChannelRegistry:
+    # Отслеживаемые каналы в памяти: поиск по ID, юзернейму и названию без запросов к MongoDB.
+    # Производные представления (страницы каталога) кэшируются до следующего изменения списка.
+    def __init__(self, channels_col):
+        self.channels_col = channels_col
+        self.channels: dict[int, dict] = {}
+        self.by_username: dict[str, dict] = {}
+        self.by_title: dict[str, dict] = {}
+        self._views: dict = {}
+        self.hits = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.channels)
+
+    def _index(self, channels: list[dict]):
+        by_id, by_username, by_title = {}, {}, {}
+        for channel in channels:
+            by_id[channel["channel_id"]] = channel
+            if channel.get("channel_username"):
+                by_username[channel["channel_username"].lower()] = channel
+            if channel.get("channel_title"):
+                by_title[channel["channel_title"]] = channel
+        self.channels, self.by_username, self.by_title = by_id, by_username, by_title
+        self._views = {}
+
+    async def load(self):
+        channels = [channel async for channel in self.channels_col.find({})]
+        self._index(channels)
+        print(f"Загружены отслеживаемые каналы: {len(self.channels)}")
+
+    def add(self, channel: dict):
+        self._index([*self.channels.values(), channel])
+
+    def remove(self, channel_id: int):
+        channels = [c for c in self.channels.values() if c["channel_id"] != channel_id]
+        self._index(channels)
+
+    def lookup(self, channel_id: int, channel_username: str | None, channel_title: str | None):
+        channel = self.channels.get(channel_id)
+        if channel is None and channel_username:
+            channel = self.by_username.get(channel_username.lower())
+        if channel is None and channel_title:
+            channel = self.by_title.get(channel_title)
+        if channel is None:
+            self.rejected += 1
+        else:
+            self.hits += 1
+        return channel
+
+    def all(self) -> list[dict]:
+        return list(self.channels.values())
+
+    def cached(self, view: str, build):
+        value = self._views.get(view)
+        if value is None:
+            value = self._views[view] = build(self.all())
+        return value
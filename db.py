@@ -1,11 +1,108 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import OperationFailure, PyMongoError
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "devradar")
 client = AsyncIOMotorClient(MONGO_URI)
-db = client["devradar"]
+db = client[MONGO_DB]
 users_col = db["users"]
 posts_col = db["posts"]
-channels_col = db["channels"]
\ No newline at end of file
+channels_col = db["channels"]
+digests_col = db["digests"]
+post_texts_col = db["post_texts"]
+outbox_col = db["outbox"]
+ledger_col = db["delivered"]
+leases_col = db["leases"]
+keyword_stats_col = db["keyword_stats"]
+
+INDEX_OPTIONS_CONFLICT = 85
+
+async def drop_ttl(col, keys: list):
+    # Срок хранения отключили (0): collMod не умеет убирать expireAfterSeconds,
+    # поэтому TTL-индекс пересоздаётся обычным - иначе MongoDB продолжит удалять документы
+    try:
+        for name, info in (await col.index_information()).items():
+            if list(info["key"]) == list(keys) and "expireAfterSeconds" in info:
+                await col.drop_index(name)
+                await col.create_index(keys)
+                print(f"TTL-индекс {name} в {col.name} заменён обычным: срок хранения отключён")
+                return
+        print(f"Не удалось создать индекс {keys} в {col.name}: конфликт параметров")
+    except PyMongoError as e:
+        print(f"Не удалось снять TTL с индекса {keys} в {col.name}: {e}")
+
+def index_specs(text_index: bool = False, text_ttl_days: int = 0, ledger_ttl_days: int = 7,
+                keyword_stats_days: int = 14) -> list:
+    # (коллекция, ключи, параметры) для всех коллекций бота
+    indexes = [
+        (posts_col, [("channel_id", ASCENDING), ("message_id", ASCENDING)], {"unique": True}),
+        (posts_col, [("processed_at", ASCENDING)], {}),
+        (post_texts_col, [("channel_id", ASCENDING), ("message_id", ASCENDING)], {"unique": True}),
+        (users_col, [("user_id", ASCENDING)], {"unique": True}),
+        # Изменения пользователей для SubscriberRegistry.refresh() в других процессах
+        (users_col, [("updated_at", ASCENDING)], {"sparse": True}),
+        (channels_col, [("channel_id", ASCENDING)], {}),
+        (digests_col, [("user_id", ASCENDING)], {"unique": True}),
+        (digests_col, [("mode", ASCENDING)], {}),
+        # Отметка есть только у постов, ещё не записанных в outbox
+        (posts_col, [("routed", ASCENDING)], {"sparse": True}),
+        (outbox_col, [("created_at", ASCENDING)], {}),
+        (ledger_col, [("at", ASCENDING)], {"expireAfterSeconds": ledger_ttl_days * 86400}),
+        (outbox_col, [("chat_id", ASCENDING)], {}),
+        (leases_col, [("kind", ASCENDING), ("expires_at", ASCENDING)], {}),
+        (keyword_stats_col, [("term", ASCENDING), ("day", ASCENDING)], {"unique": True}),
+        # Счётчик дня живёт на день дольше окна статистики
+        (keyword_stats_col, [("day", ASCENDING)], {"expireAfterSeconds": (keyword_stats_days + 1) * 86400}),
+    ]
+    if text_index:
+        # Сужение поиска при подборе вакансий из истории для нового фильтра
+        indexes.append((post_texts_col, [("text", TEXT)], {"default_language": "russian"}))
+    if text_ttl_days:
+        # Полный текст поста MongoDB удаляет сама; минимальная запись в posts остаётся
+        indexes.append((post_texts_col, [("processed_at", ASCENDING)], {"expireAfterSeconds": text_ttl_days * 86400}))
+    else:
+        indexes.append((post_texts_col, [("processed_at", ASCENDING)], {}))
+    return indexes
+
+async def ensure_indexes(text_index: bool = False, text_ttl_days: int = 0, ledger_ttl_days: int = 7,
+                         keyword_stats_days: int = 14):
+    # Индексы для горячих запросов; create_index идемпотентен, можно вызывать при каждом старте
+    indexes = index_specs(text_index, text_ttl_days, ledger_ttl_days, keyword_stats_days)
+    for col, keys, options in indexes:
+        try:
+            await col.create_index(keys, **options)
+        except OperationFailure as e:
+            if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                # Срок хранения поменяли в настройках: обновляем существующий TTL-индекс
+                await db.command("collMod", col.name, index={
+                    "keyPattern": dict(keys), "expireAfterSeconds": options["expireAfterSeconds"]
+                })
+            elif e.code == INDEX_OPTIONS_CONFLICT and not options:
+                await drop_ttl(col, keys)
+            else:
+                print(f"Не удалось создать индекс {keys} в {col.name}: {e}")
+        except PyMongoError as e:
+            print(f"Не удалось создать индекс {keys} в {col.name}: {e}")
+
+async def collection_stats() -> dict:
+    stats = {}
+    # Те же коллекции, для которых ensure_indexes создаёт индексы
+    collections = {col.name: col for col, _, _ in index_specs()}
+    for col in collections.values():
+        try:
+            result = await db.command("collStats", col.name)
+        except PyMongoError as e:
+            print(f"Не удалось получить статистику {col.name}: {e}")
+            continue
+        stats[col.name] = {
+            "count": result.get("count", 0),
+            "size": result.get("size", 0),
+            "storage_size": result.get("storageSize", 0),
+            "index_size": result.get("totalIndexSize", 0),
+            "indexes": result.get("indexSizes", {}),
+        }
+    return stats
\ No newline at end of file
@@ -0,0 +1,161 @@
+import datetime
+import hashlib
+import math
+import time
+import zlib
+from collections import OrderedDict, deque
+import numpy as np
+
+
+class RecentKeys:
+    # LRU недавно обработанных постов: повторные доставки отсекаются без обращения к базе
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._keys: OrderedDict = OrderedDict()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+
+class BloomFilter:
+    # Отрицательный ответ точный, положительный нужно подтвердить по базе
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+NUM_PERM = 32
+LSH_BANDS = 8
+LSH_ROWS = NUM_PERM // LSH_BANDS
+_MERSENNE = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20250101)
+_A = _rng.randint(1, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+
+
+def minhash(stems, shingle_size: int = 2) -> bytes:
+    # MinHash по шинглам из основ слов: перепосты с мелкими правками дают близкие подписи
+    shingles = {
+        " ".join(stems[i:i + shingle_size])
+        for i in range(max(len(stems) - shingle_size + 1, 1))
+    }
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Как в datasketch: переполнение uint64 при умножении допустимо и перемешивает биты
+    values = (np.outer(_A, hashes) + _B[:, None]) % _MERSENNE
+    return (values.min(axis=1) & np.uint64(0xFFFFFFFF)).astype("<u4").tobytes()
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    # Оценка коэффициента Жаккара: доля совпавших минимумов
+    return float(np.mean(np.frombuffer(a, dtype="<u4") == np.frombuffer(b, dtype="<u4")))
+
+
+class NearDuplicateIndex:
+    # LSH по MinHash в скользящем окне: подпись делится на LSH_BANDS полос,
+    # кандидаты - посты с хотя бы одной совпавшей полосой, затем проверяется оценка сходства.
+    def __init__(self, window: float = 72 * 3600, threshold: float = 0.7, min_tokens: int = 8):
+        self.window = window
+        self.threshold = threshold
+        self.min_tokens = min_tokens
+        self.bands: dict[tuple[int, bytes], list] = {}
+        self.entries: deque = deque()
+        self.recipients: dict = {}
+        self._remembered: deque = deque()
+        self.duplicates = 0
+        self.skipped_sends = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _bucket_keys(signature: bytes):
+        size = LSH_ROWS * 4
+        return [(band, signature[band * size:(band + 1) * size]) for band in range(LSH_BANDS)]
+
+    def _prune(self, now: float):
+        while self.entries and self.entries[0][2] < now - self.window:
+            entry = self.entries.popleft()
+            for bucket_key in self._bucket_keys(entry[1]):
+                bucket = self.bands.get(bucket_key)
+                if bucket:
+                    bucket.remove(entry)
+                    if not bucket:
+                        del self.bands[bucket_key]
+            self.recipients.pop(entry[0], None)
+
+    def remember(self, key, recipients: set, now: float):
+        # Получатели поста-оригинала живут не дольше окна; процессы-воркеры не вызывают find/add,
+        # поэтому срок считается здесь, а не только в _prune
+        if key not in self.recipients:
+            self._remembered.append((now, key))
+        self.recipients[key] = recipients
+        while self._remembered and self._remembered[0][0] < now - self.window:
+            self.recipients.pop(self._remembered.popleft()[1], None)
+
+    def find(self, signature: bytes, now: float):
+        # Возвращает кластер (ключ первого поста) похожего поста или None
+        self._prune(now)
+        checked = set()
+        for bucket_key in self._bucket_keys(signature):
+            for entry in self.bands.get(bucket_key, ()):
+                if entry[0] in checked:
+                    continue
+                checked.add(entry[0])
+                if similarity(entry[1], signature) >= self.threshold:
+                    self.duplicates += 1
+                    return entry[3]
+        return None
+
+    def add(self, key, signature: bytes, timestamp: float, cluster=None):
+        entry = (key, signature, timestamp, cluster or key)
+        self.entries.append(entry)
+        for bucket_key in self._bucket_keys(signature):
+            self.bands.setdefault(bucket_key, []).append(entry)
+
+    async def load(self, posts_col):
+        now = datetime.datetime.utcnow()
+        cursor = posts_col.find(
+            {"processed_at": {"$gte": now - datetime.timedelta(seconds=self.window)},
+             "signature": {"$exists": True}},
+            {"channel_id": 1, "message_id": 1, "signature": 1, "cluster": 1, "processed_at": 1}
+        ).sort("processed_at", 1)
+        clock = time.time()
+        async for post in cursor:
+            key = (post["channel_id"], post["message_id"])
+            cluster = tuple(post["cluster"]) if post.get("cluster") else key
+            age = (now - post["processed_at"]).total_seconds()
+            self.add(key, bytes(post["signature"]), clock - age, cluster)
+        print(f"Загружены подписи постов для поиска дубликатов: {len(self.entries)}")
@@ -0,0 +1,305 @@
+import asyncio
+import time
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from metrics import histogram, errors
+
+# Пользователь недоступен: писать ему бесполезно, пока он сам не вернётся к боту
+USER_UNREACHABLE = ("blocked by the user", "user is deactivated", "chat not found",
+                    "can't initiate conversation", "bots can't send messages to bots")
+# Пересылка из канала запрещена или недоступна боту: сразу отправляем текстом
+CHANNEL_RESTRICTED = ("protected", "can't be forwarded", "forwards_restricted",
+                      "not a member of the channel", "kicked from the channel")
+CHAT_NOT_FOUND = "chat not found"
+NO_FORWARD_TTL = 24 * 3600
+
+
+def classify_error(error: Exception) -> str:
+    message = str(error).lower()
+    if any(s in message for s in CHANNEL_RESTRICTED):
+        return "channel"
+    if any(s in message for s in USER_UNREACHABLE) or isinstance(error, Forbidden):
+        return "user"
+    return "post"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        # Сколько ждать до следующего токена; 0 - токен уже списан
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class Delivery:
+    __slots__ = ("chat_id", "from_chat_id", "message_id", "text", "channel_title",
+                 "post_link", "user_filter", "enqueued_at", "attempts", "on_done")
+
+    # on_done(sent) - вызывается после попытки отправки (дайджест удаляется только после доставки)
+    def __init__(self, chat_id, from_chat_id, message_id, text, channel_title, post_link, user_filter,
+                 on_done=None):
+        self.chat_id = chat_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.text = text
+        self.channel_title = channel_title
+        self.post_link = post_link
+        self.user_filter = user_filter
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.on_done = on_done
+
+    @property
+    def key(self) -> str | None:
+        # Ключ доставки для журнала: один пост одному пользователю
+        if self.from_chat_id is None:
+            return None
+        return f"{self.chat_id}:{self.from_chat_id}:{self.message_id}"
+
+
+class DeliveryQueue:
+    # Рассылка отделена от сопоставления: обработчик поста только ставит задачи в очередь,
+    # а пул воркеров отправляет их с учётом лимитов Telegram (глобального и на чат).
+    def __init__(self, render_fallback, workers: int = 8, maxsize: int = 10000,
+                 global_rate: float = 25.0, chat_rate: float = 1.0, max_retries: int = 5,
+                 on_blocked=None, on_restricted=None, outbox=None):
+        self.render_fallback = render_fallback
+        self.outbox = outbox
+        self.on_blocked = on_blocked
+        self.on_restricted = on_restricted
+        self.blocked: set[int] = set()
+        self.no_forward: dict[int, float] = {}
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self._tasks: list[asyncio.Task] = []
+        self.bot = None
+
+        self.sent = 0
+        self.forwarded = 0
+        self.fallbacks = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.blocked_found = 0
+        self.retries = 0
+        self.failed = 0
+        self.send_latency = histogram()
+        self.delivery_lag = histogram()
+
+    def start(self, bot):
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, delivery: Delivery):
+        await self.queue.put(delivery)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def _acquire(self, chat_id: int):
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.is_full()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+    async def _call(self, method, **kwargs):
+        await self._acquire(kwargs["chat_id"])
+        started = time.monotonic()
+        try:
+            return await method(**kwargs)
+        finally:
+            self.send_latency.observe(time.monotonic() - started)
+
+    def can_forward(self, channel_id: int) -> bool:
+        until = self.no_forward.get(channel_id)
+        if until is None:
+            return True
+        if until < time.monotonic():
+            del self.no_forward[channel_id]
+            return True
+        return False
+
+    def restrict_channel(self, channel_id: int, ttl: float = NO_FORWARD_TTL) -> bool:
+        # Через ttl пересылка будет проверена снова: защиту канала могут снять
+        known = not self.can_forward(channel_id)
+        self.no_forward[channel_id] = time.monotonic() + ttl
+        return not known
+
+    def unblock(self, user_id: int):
+        self.blocked.discard(user_id)
+
+    async def _mark_blocked(self, user_id: int, error: Exception):
+        if user_id in self.blocked:
+            return
+        self.blocked.add(user_id)
+        self.blocked_found += 1
+        print(f"Пользователь {user_id} недоступен, рассылка остановлена: {error}")
+        if self.on_blocked:
+            await self.on_blocked(user_id)
+
+    async def _mark_restricted(self, channel_id: int, error: Exception):
+        if self.restrict_channel(channel_id):
+            print(f"Пересылка из канала {channel_id} недоступна, отправляем текстом: {error}")
+            if self.on_restricted:
+                await self.on_restricted(channel_id)
+
+    async def _send(self, delivery: Delivery) -> bool:
+        if delivery.chat_id in self.blocked:
+            self.skipped += 1
+            return False
+
+        forward_error = None
+        if delivery.from_chat_id is not None and self.can_forward(delivery.from_chat_id):
+            try:
+                await self._call(
+                    self.bot.forward_message,
+                    chat_id=delivery.chat_id,
+                    from_chat_id=delivery.from_chat_id,
+                    message_id=delivery.message_id
+                )
+                self.forwarded += 1
+                return True
+            except (BadRequest, Forbidden) as e:
+                kind = classify_error(e)
+                # «chat not found» при пересылке может относиться и к каналу: решит отправка текстом
+                if kind == "user" and CHAT_NOT_FOUND not in str(e).lower():
+                    await self._mark_blocked(delivery.chat_id, e)
+                    return False
+                if kind == "channel":
+                    await self._mark_restricted(delivery.from_chat_id, e)
+                forward_error = e
+                self.fallbacks += 1
+
+        # Готовый текст (дайджест) или пересылка недоступна
+        text = delivery.text if delivery.from_chat_id is None else self.render_fallback(delivery)
+        try:
+            await self._call(
+                self.bot.send_message,
+                chat_id=delivery.chat_id,
+                text=text,
+                parse_mode='HTML',
+                disable_web_page_preview=True
+            )
+        except (BadRequest, Forbidden) as e:
+            if classify_error(e) == "user":
+                await self._mark_blocked(delivery.chat_id, e)
+                return False
+            raise
+        if forward_error is not None and CHAT_NOT_FOUND in str(forward_error).lower():
+            await self._mark_restricted(delivery.from_chat_id, forward_error)
+        return True
+
+    async def _worker(self):
+        while True:
+            delivery = await self.queue.get()
+            sent = False
+            failed = False
+            try:
+                if self.outbox and await self.outbox.delivered(delivery):
+                    # Уже доставлено до перезапуска: журнал не даёт отправить второй раз
+                    self.duplicates += 1
+                else:
+                    sent = await self._deliver(delivery)
+            except asyncio.CancelledError:
+                # Остановка: запись остаётся в outbox и будет отправлена после перезапуска
+                self.queue.task_done()
+                raise
+            except Exception as e:
+                self.failed += 1
+                failed = True
+                errors["delivery"] += 1
+                print(f"Ошибка при отправке пользователю {delivery.chat_id}: {e}")
+            if self.outbox:
+                if failed:
+                    self.outbox.fail(delivery)
+                else:
+                    self.outbox.ack(delivery, sent)
+            if delivery.on_done:
+                try:
+                    await delivery.on_done(sent)
+                except Exception as e:
+                    errors["delivery"] += 1
+                    print(f"Ошибка подтверждения отправки пользователю {delivery.chat_id}: {e}")
+            self.queue.task_done()
+
+    async def _deliver(self, delivery: Delivery) -> bool:
+        while True:
+            delivery.attempts += 1
+            try:
+                if await self._send(delivery):
+                    self.sent += 1
+                    self.delivery_lag.observe(time.monotonic() - delivery.enqueued_at)
+                    return True
+                return False
+            except RetryAfter as e:
+                # Флуд-лимит общий для бота: притормаживаем все воркеры
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                if delivery.attempts > self.max_retries:
+                    raise
+            except (BadRequest, Forbidden):
+                raise
+            except NetworkError:
+                if delivery.attempts > self.max_retries:
+                    raise
+                await asyncio.sleep(min(2 ** delivery.attempts, 60))
+            self.retries += 1
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "sent": self.sent,
+            "forwarded": self.forwarded,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": self.fallbacks / (self.forwarded + self.fallbacks) if self.fallbacks else 0.0,
+            "skipped_blocked": self.skipped,
+            "duplicates": self.duplicates,
+            "blocked_users": len(self.blocked),
+            "blocked_found": self.blocked_found,
+            "no_forward_channels": len(self.no_forward),
+            "retries": self.retries,
+            "failed": self.failed,
+            "send_latency": self.send_latency.snapshot(),
+            "delivery_lag": self.delivery_lag.snapshot(),
+        }
@@ -0,0 +1,123 @@
+import html
+from functools import partial
+from pymongo import UpdateOne
+from delivery import Delivery
+
+INSTANT = "instant"
+DIGEST_MODES = ("hourly", "daily")
+PREVIEW_LENGTH = 80
+TITLE_LENGTH = 40
+# Лимит Telegram - 4096 символов, оставляем запас
+MESSAGE_LENGTH = 4000
+
+
+def preview(text: str) -> str:
+    line = next((l.strip() for l in text.splitlines() if l.strip()), "")
+    return line if len(line) <= PREVIEW_LENGTH else line[:PREVIEW_LENGTH - 1] + "…"
+
+
+def shorten(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+
+def render_digest(doc: dict, limit: int = 30, max_length: int = MESSAGE_LENGTH) -> str:
+    items = doc.get("items", [])
+    total = max(doc.get("total", 0), len(items))
+    header = f"📬 <b>Дайджест вакансий</b> ({total})\n"
+    # Самые свежие строки, пока сообщение укладывается в лимит (с местом под «…и ещё»)
+    budget = max_length - len(header) - 30
+    lines = []
+    for item in reversed(items[-limit:]):
+        title = html.escape(shorten(item.get("title") or "Канал", TITLE_LENGTH), quote=False)
+        text = html.escape(item.get("preview") or "", quote=False)
+        line = f"• <a href='{item['link']}'>{title}</a>: {text}"
+        budget -= len(line) + 1
+        if budget < 0:
+            break
+        lines.append(line)
+    lines.reverse()
+    rest = total - len(lines)
+    if rest > 0:
+        lines.append(f"\n…и ещё {rest}")
+    return "\n".join([header, *lines])
+
+
+class DigestStore:
+    # Совпадения пользователей с режимом дайджеста копятся в MongoDB (документ на пользователя,
+    # список обрезается до max_items) и раз в час или сутки уходят одним сообщением
+    def __init__(self, digests_col, max_items: int = 50):
+        self.digests_col = digests_col
+        self.max_items = max_items
+        self.queued = 0
+        self.sent = 0
+        self.delivered = 0
+        # Пользователи, чей дайджест стоит в очереди рассылки: повторно не ставим
+        self._sending: set[int] = set()
+
+    async def add_many(self, entries: list[tuple[int, str, dict]]):
+        by_user: dict[int, tuple[str, list]] = {}
+        for user_id, mode, item in entries:
+            by_user.setdefault(user_id, (mode, []))[1].append(item)
+        if not by_user:
+            return
+        requests = [
+            UpdateOne(
+                {"user_id": user_id},
+                {
+                    "$push": {"items": {"$each": items, "$slice": -self.max_items}},
+                    "$inc": {"total": len(items)},
+                    "$set": {"mode": mode},
+                },
+                upsert=True
+            )
+            for user_id, (mode, items) in by_user.items()
+        ]
+        await self.digests_col.bulk_write(requests, ordered=False)
+        self.queued += len(entries)
+
+    async def flush(self, mode: str, delivery_queue) -> int:
+        # Документ удаляется только после отправки: при остановке или ошибке дайджест уйдёт в следующий раз
+        user_ids = [doc["user_id"] async for doc in self.digests_col.find({"mode": mode}, {"user_id": 1})]
+        sent = 0
+        for user_id in user_ids:
+            if user_id in self._sending:
+                continue
+            doc = await self.digests_col.find_one({"user_id": user_id, "mode": mode})
+            if not doc:
+                continue
+            if not doc.get("items"):
+                await self.digests_col.delete_one({"_id": doc["_id"], "items": {"$size": 0}})
+                continue
+            self._sending.add(user_id)
+            await delivery_queue.put(Delivery(
+                chat_id=user_id,
+                from_chat_id=None,
+                message_id=None,
+                text=render_digest(doc),
+                channel_title=None,
+                post_link=None,
+                user_filter=None,
+                on_done=partial(self._done, doc)
+            ))
+            sent += 1
+        self.sent += sent
+        return sent
+
+    async def _done(self, doc: dict, sent: bool):
+        self._sending.discard(doc["user_id"])
+        if sent:
+            await self.acknowledge(doc)
+            self.delivered += 1
+
+    async def acknowledge(self, doc: dict):
+        # Совпадения, пришедшие во время рассылки, остаются в документе до следующего дайджеста
+        result = await self.digests_col.delete_one({"_id": doc["_id"], "total": doc.get("total", 0)})
+        if not result.deleted_count:
+            await self.digests_col.update_one(
+                {"_id": doc["_id"]},
+                {"$pull": {"items": {"link": {"$in": [item["link"] for item in doc["items"]]}}},
+                 "$inc": {"total": -doc.get("total", 0)}}
+            )
+
+    def stats(self) -> dict:
+        return {"queued": self.queued, "sent": self.sent, "delivered": self.delivered, "sending": len(self._sending)}
@@ -0,0 +1,240 @@
+import re
+
+# Структурные поля вакансии: извлекаются один раз при разборе поста (filters.PreparedText)
+# и сохраняются в posts.fields. Фильтры проверяют их условиями вида salary>=150k, format=remote, stack=python.
+FORMATS = ("remote", "office", "hybrid", "relocation")
+SENIORITY = ("intern", "junior", "middle", "senior", "lead")
+CATEGORICAL = ("format", "seniority", "stack")
+
+# Начала слов (после приведения к нижнему регистру и ё -> е): «удалённо», «удалёнка», «офисе»
+PREFIXES = {
+    "удален": ("format", "remote"),
+    "дистанцион": ("format", "remote"),
+    "remote": ("format", "remote"),
+    "офис": ("format", "office"),
+    "office": ("format", "office"),
+    "onsite": ("format", "office"),
+    "гибрид": ("format", "hybrid"),
+    "hybrid": ("format", "hybrid"),
+    "релокац": ("format", "relocation"),
+    "relocat": ("format", "relocation"),
+    "стажер": ("seniority", "intern"),
+    "стажир": ("seniority", "intern"),
+    "intern": ("seniority", "intern"),
+    "trainee": ("seniority", "intern"),
+    "junior": ("seniority", "junior"),
+    "джун": ("seniority", "junior"),
+    "младш": ("seniority", "junior"),
+    "middle": ("seniority", "middle"),
+    "мидл": ("seniority", "middle"),
+    "senior": ("seniority", "senior"),
+    "сеньор": ("seniority", "senior"),
+    "синьор": ("seniority", "senior"),
+    "старш": ("seniority", "senior"),
+    "тимлид": ("seniority", "lead"),
+    "техлид": ("seniority", "lead"),
+    "teamlead": ("seniority", "lead"),
+    "techlead": ("seniority", "lead"),
+}
+# Короткие слова сравниваются целиком: «лид» не должен находиться в «лидогенерации»
+EXACT = {
+    "lead": ("seniority", "lead"),
+    "лид": ("seniority", "lead"),
+    "jun": ("seniority", "junior"),
+    "mid": ("seniority", "middle"),
+    "sen": ("seniority", "senior"),
+}
+PREFIX_LENGTHS = sorted({len(prefix) for prefix in PREFIXES})
+NEGATIONS = {"не", "без", "no", "not", "non"}
+
+STACK = {
+    "python": "python", "питон": "python", "go": "go", "golang": "go", "java": "java",
+    "kotlin": "kotlin", "c++": "c++", "cpp": "c++", "c#": "c#", "csharp": "c#",
+    ".net": ".net", "dotnet": ".net", "asp.net": ".net", "javascript": "javascript", "js": "javascript",
+    "typescript": "typescript", "ts": "typescript", "react": "react", "reactjs": "react",
+    "react.js": "react", "vue": "vue", "vuejs": "vue", "vue.js": "vue", "angular": "angular",
+    "node.js": "node.js", "nodejs": "node.js", "node": "node.js", "php": "php", "laravel": "laravel",
+    "rust": "rust", "scala": "scala", "swift": "swift", "1с": "1c", "1c": "1c", "sql": "sql",
+    "postgresql": "postgresql", "postgres": "postgresql", "mysql": "mysql", "mongodb": "mongodb",
+    "mongo": "mongodb", "redis": "redis", "kafka": "kafka", "docker": "docker",
+    "kubernetes": "kubernetes", "k8s": "kubernetes", "aws": "aws", "linux": "linux",
+    "django": "django", "fastapi": "fastapi", "flask": "flask", "flutter": "flutter",
+    "unity": "unity", "spark": "spark", "airflow": "airflow", "terraform": "terraform",
+    "ruby": "ruby", "rails": "ruby", "android": "android", "ios": "ios",
+}
+DOTNET_RE = re.compile(r"(?<![\w.])\.net\b", re.IGNORECASE)
+
+_NUMBER = r"\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+(?:[.,]\d+)?"
+_MULTIPLIER = r"k|к|тыс\.?|т\.р\.?"
+_CURRENCY = r"₽|руб(?:лей|\.)?|р\.|rub|usd|\$|€|eur|евро|долл(?:аров|\.)?"
+# Опережающая проверка первого символа: без неё поиск пробует каждую позицию текста целиком
+SALARY_RE = re.compile(
+    rf"(?=[\d$€₽одfut])(?:\b(?P<prefix>от|from|до|up to|to)\s*)?(?P<cur1>[$€₽])?\s*(?P<a>{_NUMBER})\s*(?P<m1>{_MULTIPLIER})?"
+    rf"(?:\s*(?:-|–|—|до|to)\s*(?P<cur2>[$€₽])?\s*(?P<b>{_NUMBER})\s*(?P<m2>{_MULTIPLIER})?)?"
+    rf"\s*(?P<cur3>{_CURRENCY})?(?!\w)",
+    re.IGNORECASE
+)
+CURRENCIES = {"₽": "RUB", "руб": "RUB", "р.": "RUB", "rub": "RUB",
+              "$": "USD", "usd": "USD", "долл": "USD", "€": "EUR", "eur": "EUR", "евро": "EUR"}
+# Нижняя граница правдоподобной месячной зарплаты: отсекает «5k подписчиков» и номера версий
+MIN_SALARY = {"RUB": 10000, "USD": 300, "EUR": 300}
+MAX_SALARY = 100_000_000
+
+
+def _number(value: str, multiplier: str | None) -> float:
+    number = float(re.sub(r"[ \u00a0\u202f]", "", value).replace(",", "."))
+    return number * 1000 if multiplier else number
+
+
+def _currency(*markers) -> str | None:
+    for marker in markers:
+        if marker:
+            marker = marker.casefold()
+            for prefix, currency in CURRENCIES.items():
+                if marker.startswith(prefix):
+                    return currency
+    return None
+
+
+def parse_amount(text: str) -> tuple[float, str | None] | None:
+    # «150k», «150 000 ₽», «$3000», «3k usd» -> (сумма, валюта или None)
+    m = SALARY_RE.fullmatch(text.strip())
+    if not m or m.group("b"):
+        return None
+    return _number(m.group("a"), m.group("m1")), _currency(m.group("cur1"), m.group("cur3"))
+
+
+def extract_salary(text: str) -> dict | None:
+    for m in SALARY_RE.finditer(text):
+        currency = _currency(m.group("cur1"), m.group("cur2"), m.group("cur3"))
+        multiplier = m.group("m2") if m.group("b") else m.group("m1")
+        if not currency and not (m.group("m1") or m.group("m2")):
+            # Без валюты и «к/тыс» это скорее опыт, возраст или год
+            continue
+        currency = currency or "RUB"
+        low = _number(m.group("a"), m.group("m1") or multiplier)
+        high = _number(m.group("b"), m.group("m2")) if m.group("b") else None
+        if high is None:
+            prefix = (m.group("prefix") or "").casefold()
+            if prefix in ("до", "to", "up to"):
+                low, high = None, low
+            elif prefix not in ("от", "from"):
+                high = low
+        amounts = [v for v in (low, high) if v is not None]
+        if min(amounts) < MIN_SALARY[currency] or max(amounts) > MAX_SALARY:
+            continue
+        salary = {"currency": currency}
+        if low is not None:
+            salary["min"] = int(low)
+        if high is not None:
+            salary["max"] = int(high)
+        return salary
+    return None
+
+
+def classify_word(word: str) -> tuple[str, str] | None:
+    found = EXACT.get(word)
+    if found:
+        return found
+    for length in PREFIX_LENGTHS:
+        if len(word) < length:
+            break
+        found = PREFIXES.get(word[:length])
+        if found:
+            return found
+    return None
+
+
+def extract(prepared) -> dict:
+    # Один проход по словам поста: формат и уровень по началам основ (с учётом «не/без»),
+    # стек - точным поиском слова в словаре, зарплата - регулярным выражением по тексту
+    fields: dict[str, set] = {}
+    stems = prepared.stems
+    for i, word in enumerate(stems):
+        found = classify_word(word)
+        if found and not (i and stems[i - 1] in NEGATIONS):
+            fields.setdefault(found[0], set()).add(found[1])
+    stack = {STACK[word] for word in prepared.words if word in STACK}
+    if DOTNET_RE.search(prepared.text):
+        stack.add(".net")
+    if stack:
+        fields["stack"] = stack
+    result = {field: sorted(values) for field, values in fields.items()}
+    salary = extract_salary(prepared.text)
+    if salary:
+        result["salary"] = salary
+    return result
+
+
+class Predicate:
+    # Условие фильтра на структурное поле: format=remote, stack=python, salary>=150k
+    __slots__ = ("field", "op", "value", "currency")
+
+    def __init__(self, field: str, op: str, value, currency: str | None = None):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.currency = currency
+
+    def __repr__(self):
+        return f"Predicate({self.field}{self.op}{self.value}{' ' + self.currency if self.currency else ''})"
+
+    @property
+    def key(self) -> str:
+        # Ключ в индексе категориальных условий
+        return f"{self.field}={self.value}"
+
+    @property
+    def stat_key(self) -> str:
+        # Ключ в статистике частот: для зарплаты - доля постов, где она вообще указана
+        return "salary=*" if self.field == "salary" else self.key
+
+    def matches(self, fields: dict | None) -> bool:
+        if not fields:
+            return False
+        if self.field != "salary":
+            return self.value in fields.get(self.field, ())
+        salary = fields.get("salary")
+        if not salary or salary["currency"] != self.currency:
+            return False
+        if self.op == ">=":
+            return salary.get("max", salary.get("min", 0)) >= self.value
+        return salary.get("min", salary.get("max", 0)) <= self.value
+
+
+FIELD_ALIASES = {
+    "salary": "salary", "зп": "salary", "зарплата": "salary",
+    "format": "format", "формат": "format",
+    "level": "seniority", "seniority": "seniority", "grade": "seniority", "уровень": "seniority",
+    "stack": "stack", "tech": "stack", "стек": "stack",
+}
+PREDICATE_RE = re.compile(r"^\s*(?P<field>[a-zа-яё]+)\s*(?P<op>>=|<=|=|∋|:)\s*(?P<value>\S.*?)\s*$", re.IGNORECASE)
+
+
+def looks_like_predicate(word: str) -> bool:
+    m = PREDICATE_RE.match(word)
+    return bool(m) and m.group("field").casefold().replace("ё", "е") in FIELD_ALIASES
+
+
+def parse_predicate(word: str) -> Predicate | None:
+    m = PREDICATE_RE.match(word)
+    if not m:
+        return None
+    field = FIELD_ALIASES.get(m.group("field").casefold().replace("ё", "е"))
+    op = m.group("op")
+    value = m.group("value").casefold().replace("ё", "е")
+    if field == "salary":
+        amount = parse_amount(value)
+        if not amount:
+            return None
+        return Predicate(field, "<=" if op == "<=" else ">=", amount[0], amount[1] or "RUB")
+    if field is None or op in (">=", "<="):
+        return None
+    if field == "stack":
+        tag = STACK.get(value)
+        return Predicate(field, "=", tag) if tag else None
+    canonical = FORMATS if field == "format" else SENIORITY
+    found = (field, value) if value in canonical else classify_word(value)
+    if not found or found[0] != field:
+        return None
+    return Predicate(field, "=", found[1])
@@ -1,10 +1,13 @@
-from rapidfuzz import fuzz
+import html
+import re
+from functools import lru_cache
+from extract import extract, parse_predicate
+from metrics import filter_checks, ENABLED as METRICS_ENABLED
 
 SYNONYMS = {
     "питон": ["python"],
-    "дистанционно": ["удаленно", "удалённо", "remote"],
+    "дистанционно": ["удаленно", "remote"],
     "без опыта": ["junior", "начинающий", "intern"],
-    "офис": ["офисе", "офиса"],
     "гибрид": ["гибридно", "hybrid"],
     "стажировка": ["internship", "стажёр"],
     "зарплата": ["оплата", "salary", "зп"],
@@ -13,23 +16,305 @@ SYNONYMS = {
     "frontend": ["фронтенд"]
 }
 
+FUZZY_MARKER = "~"
+# «-senior» - пост с этим словом не подходит; «python|go» - любое из слов
+EXCLUDE_MARKER = "-"
+OR_SEPARATOR = "|"
+FUZZY_MIN_LENGTH = 4
+MAX_PHRASE_WORDS = 4
+
+TOKEN_RE = re.compile(r"\w[\w+#]*(?:[.\-]\w[\w+#]*)*")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Упрощённый стеммер Портера для русского языка
+_RV_RE = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_PERFECTIVE_GERUND_RE = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE_RE = re.compile(r"(с[яь])$")
+_ADJECTIVE_RE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE_RE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB_RE = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN_RE = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL_RE = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+_DER_RE = re.compile(r"ость?$")
+_SUPERLATIVE_RE = re.compile(r"(ейше|ейш)$")
+
+def fold(text: str) -> str:
+    return text.casefold().replace("ё", "е")
+
+def _stem_russian(word: str) -> str:
+    m = _RV_RE.match(word)
+    if not m:
+        return word
+    pre, rv = m.groups()
+
+    temp = _PERFECTIVE_GERUND_RE.sub("", rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE_RE.sub("", rv, 1)
+        temp = _ADJECTIVE_RE.sub("", rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE_RE.sub("", temp, 1)
+        else:
+            temp = _VERB_RE.sub("", rv, 1)
+            rv = _NOUN_RE.sub("", rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    if _DERIVATIONAL_RE.match(rv):
+        rv = _DER_RE.sub("", rv, 1)
+    if rv.endswith("ь"):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE_RE.sub("", rv, 1)
+        if rv.endswith("нн"):
+            rv = rv[:-1]
+    # Слишком короткая основа чаще ошибка («опыт» -> «оп»), оставляем слово как есть
+    return pre + rv if len(pre + rv) >= 3 else word
+
+def _stem_english(word: str) -> str:
+    # Только множественное число: названия технологий не трогаем
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+@lru_cache(maxsize=100000)
+def stem(token: str) -> str:
+    if CYRILLIC_RE.search(token):
+        return _stem_russian(token)
+    if token.isascii() and token.isalpha():
+        return _stem_english(token)
+    return token
+
+def tokenize(text: str) -> list[str]:
+    # Составные слова («full-stack») дают части по отдельности, чтобы совпадали фразы
+    tokens = []
+    for token in TOKEN_RE.findall(fold(text)):
+        if "-" in token:
+            tokens.extend(part for part in token.split("-") if part)
+        else:
+            tokens.append(token)
+    return tokens
+
+def keyword_key(keyword: str) -> str:
+    # Ключевое слово или фраза -> основы слов через пробел
+    return " ".join(stem(token) for token in tokenize(keyword))
+
+class PreparedText:
+    # Результат разбора поста: считается один раз и разделяется всеми фильтрами.
+    # fields - структурные поля вакансии (см. extract.py); готовые можно передать из posts.fields
+    __slots__ = ("text", "words", "stems", "terms", "fields")
+
+    def __init__(self, text: str, max_phrase: int = MAX_PHRASE_WORDS, fields: dict | None = None):
+        self.text = text
+        tokens = tokenize(text)
+        self.words = frozenset(tokens)
+        self.stems = stems = tuple(stem(token) for token in tokens)
+        terms = set(stems)
+        for n in range(2, max_phrase + 1):
+            for i in range(len(stems) - n + 1):
+                terms.add(" ".join(stems[i:i + n]))
+        self.terms = frozenset(terms)
+        self.fields = fields if fields is not None else extract(self)
+
+def prepare_text(text: str, max_phrase: int = MAX_PHRASE_WORDS, fields: dict | None = None) -> PreparedText:
+    return PreparedText(text, max_phrase, fields)
+
 def normalize(word: str):
     word = word.lower().strip()
     return list(set([word] + SYNONYMS.get(word, [])))  # Убираем дубликаты
 
-def text_matches_filters(text: str, filters: list[list[str]]) -> bool:
-    text = text.lower()
-
-    for group in filters:
-        found = False
-        for word in group:
-            variants = normalize(word)
-            for variant in variants:
-                if variant.lower() in text:
-                    found = True
+_variants_cache: dict[str, tuple[str, ...]] = {}
+
+def word_variants(word: str) -> tuple[str, ...]:
+    # Основы всех синонимов слова; кортеж разделяется всеми фильтрами с этим словом
+    variants = _variants_cache.get(word)
+    if variants is None:
+        variants = tuple(sorted({keyword_key(v) for v in normalize(word)}))
+        _variants_cache[word] = variants
+    return variants
+
+def is_fuzzy(word: str) -> bool:
+    return word.startswith(FUZZY_MARKER)
+
+def strip_marker(word: str) -> str:
+    return word[len(FUZZY_MARKER):] if is_fuzzy(word) else word
+
+def is_excluded(word: str) -> bool:
+    return strip_marker(word).startswith(EXCLUDE_MARKER)
+
+def bare_word(word: str) -> str:
+    return strip_marker(word).removeprefix(EXCLUDE_MARKER)
+
+def parse_group(item: str, fuzzy: bool = False) -> list[str] | None:
+    # «python|go» -> ["python", "go"]; «-senior|lead» -> ["-senior", "-lead"] (ни одного из слов).
+    # None - пустая альтернатива или минус внутри группы
+    excluded = item.startswith(EXCLUDE_MARKER)
+    alternatives = [a.strip() for a in item.removeprefix(EXCLUDE_MARKER).split(OR_SEPARATOR)]
+    if len(alternatives) > 1 and not all(alternatives):
+        return None
+    if excluded and not alternatives[0]:
+        return None
+    if any(a.startswith(EXCLUDE_MARKER) for a in alternatives):
+        return None
+    if excluded:
+        return [EXCLUDE_MARKER + a for a in alternatives]
+    return [FUZZY_MARKER + a if fuzzy else a for a in alternatives]
+
+def format_group(group: list[str]) -> str:
+    if group and all(is_excluded(word) for word in group):
+        return EXCLUDE_MARKER + OR_SEPARATOR.join(bare_word(word) for word in group)
+    return OR_SEPARATOR.join(group)
+
+class CompiledFilter:
+    # Фильтр, развёрнутый заранее: группы -> кортежи основ ключевых слов и их синонимов.
+    # Группа с пустым словом выполняется всегда и в groups не попадает.
+    # Слова с префиксом «~» дополнительно сравниваются нечётко (fuzzy_groups).
+    # Условия на структурные поля (salary>=150k, format=remote) - в predicates той же группы.
+    # order - порядок проверки групп: от самой редкой по статистике ключевых слов (keyword_stats.py)
+    # Слова с «-» (и условия вроде -format=office) не входят в группы: любое из них отклоняет пост.
+    __slots__ = ("source", "groups", "fuzzy_groups", "predicates", "terms", "max_phrase", "order",
+                 "excluded", "excluded_predicates")
+
+    def __init__(self, source: list[list[str]]):
+        self.source = source
+        groups = []
+        fuzzy_groups = []
+        predicates = []
+        excluded = set()
+        excluded_predicates = []
+        for group in source:
+            conditions = []
+            words = []
+            for word in group:
+                if is_excluded(word):
+                    predicate = parse_predicate(bare_word(word))
+                    if predicate:
+                        excluded_predicates.append(predicate)
+                    else:
+                        excluded.update(v for v in word_variants(bare_word(word)) if v)
+                    continue
+                predicate = parse_predicate(strip_marker(word))
+                if predicate:
+                    conditions.append(predicate)
+                else:
+                    words.append(word)
+            variants = {v for word in words for v in word_variants(strip_marker(word))}
+            # Группа только из исключений в groups тоже не попадает
+            if "" in variants or not (variants or conditions):
+                continue
+            groups.append(tuple(sorted(variants)))
+            predicates.append(tuple(conditions))
+            fuzzy_groups.append(tuple(sorted({
+                fold(v) for word in words if is_fuzzy(word)
+                for v in normalize(strip_marker(word))
+                if len(v) >= FUZZY_MIN_LENGTH and len(tokenize(v)) == 1
+            })))
+        self.groups = tuple(groups)
+        self.fuzzy_groups = tuple(fuzzy_groups)
+        self.predicates = tuple(predicates)
+        self.excluded = frozenset(excluded)
+        self.excluded_predicates = tuple(excluded_predicates)
+        self.terms = frozenset(v for group in self.groups for v in group)
+        self.max_phrase = max((v.count(" ") + 1 for v in self.terms | self.excluded), default=1)
+        self.order = tuple(range(len(self.groups)))
+
+    @property
+    def fuzzy(self) -> bool:
+        return any(self.fuzzy_groups)
+
+    def group_keys(self, gi: int) -> tuple[str, ...]:
+        # Ключи статистики группы: основы слов и условия на поля
+        return self.groups[gi] + tuple(predicate.stat_key for predicate in self.predicates[gi])
+
+    def stat_keys(self) -> set[str]:
+        return {key for gi in range(len(self.groups)) for key in self.group_keys(gi)}
+
+    def selectivity_order(self, frequencies: dict[str, float]) -> tuple[int, ...]:
+        # Доля постов, где выполняется группа, оценивается суммой частот её слов;
+        # при равных оценках сохраняется порядок пользователя
+        if not frequencies:
+            return tuple(range(len(self.groups)))
+        return tuple(sorted(
+            range(len(self.groups)),
+            key=lambda gi: min(1.0, sum(frequencies.get(key, 0.0) for key in self.group_keys(gi)))
+        ))
+
+    def reorder(self, frequencies: dict[str, float]):
+        self.order = self.selectivity_order(frequencies)
+
+    def __repr__(self):
+        return f"CompiledFilter({self.source!r})"
+
+    def rejects(self, prepared: PreparedText) -> bool:
+        if self.excluded and not self.excluded.isdisjoint(prepared.terms):
+            return True
+        return any(condition.matches(prepared.fields) for condition in self.excluded_predicates)
+
+    def matches(self, prepared: PreparedText) -> bool:
+        # Горячий путь сопоставления: счётчики проверок только при включённых метриках
+        if METRICS_ENABLED:
+            filter_checks["filters"] += 1
+        if self.rejects(prepared):
+            return False
+        terms = prepared.terms
+        checked = 0
+        for gi in self.order:
+            checked += 1
+            for variant in self.groups[gi]:
+                if variant in terms:
                     break
-            if found:
+            else:
+                if not any(condition.matches(prepared.fields) for condition in self.predicates[gi]):
+                    if METRICS_ENABLED:
+                        filter_checks["groups"] += checked
+                    return False
+        if METRICS_ENABLED:
+            filter_checks["groups"] += checked
+        return True
+
+def highlight(text: str, compiled: CompiledFilter) -> str:
+    # Один проход по словам поста: экранируем HTML и оборачиваем в <b> слова и фразы,
+    # чьи основы есть в фильтре. Длинные фразы проверяются раньше одиночных слов.
+    spans = []
+    for m in TOKEN_RE.finditer(text):
+        pos = m.start()
+        for part in m.group().split("-"):
+            if part:
+                spans.append((pos, pos + len(part), stem(fold(part))))
+            pos += len(part) + 1
+
+    parts = []
+    last = 0
+    i = 0
+    while i < len(spans):
+        start = spans[i][0]
+        matched = 0
+        for n in range(min(compiled.max_phrase, len(spans) - i), 0, -1):
+            if " ".join(s[2] for s in spans[i:i + n]) in compiled.terms:
+                matched = n
                 break
-        if not found:
-            return False
-    return True
\ No newline at end of file
+        if matched:
+            end = spans[i + matched - 1][1]
+            parts.append(html.escape(text[last:start], quote=False))
+            parts.append(f"<b>{html.escape(text[start:end], quote=False)}</b>")
+            last = end
+            i += matched
+        else:
+            i += 1
+    parts.append(html.escape(text[last:], quote=False))
+    return "".join(parts)
+
+def compile_filters(filters_list: list[list[list[str]]]) -> tuple[CompiledFilter, ...]:
+    return tuple(CompiledFilter(f) for f in filters_list)
+
+def text_matches_filters(text: str, filters: list[list[str]]) -> bool:
+    compiled = CompiledFilter(filters)
+    return compiled.matches(prepare_text(text, compiled.max_phrase))
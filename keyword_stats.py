@@ -0,0 +1,103 @@
+import datetime
+from collections import Counter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from extract import CATEGORICAL
+
+TOTAL = ""
+
+
+class KeywordStats:
+    # Документная частота ключевых слов фильтров: в скольких постах за последние window_days дней
+    # встречалась основа слова или условие на поле (format=remote). Счётчики копятся в памяти
+    # и пишутся в keyword_stats по дням через $inc, старые дни удаляет TTL-индекс.
+    # По частотам группы фильтров проверяются от самой редкой.
+    def __init__(self, stats_col, window_days: int = 14, min_posts: int = 200):
+        self.stats_col = stats_col
+        self.window_days = window_days
+        self.min_posts = min_posts
+        self.counts: Counter = Counter()
+        self.posts = 0
+        self._pending: Counter = Counter()
+        self.loaded_at = None
+        self.flushes = 0
+
+    def observe(self, prepared, vocabulary):
+        # vocabulary - ключи всех фильтров (MatchEngine.vocabulary): слова вне фильтров не считаем
+        found = [term for term in prepared.terms if term in vocabulary]
+        fields = prepared.fields
+        if fields:
+            for field in CATEGORICAL:
+                for value in fields.get(field, ()):
+                    key = f"{field}={value}"
+                    if key in vocabulary:
+                        found.append(key)
+            if fields.get("salary") and "salary=*" in vocabulary:
+                found.append("salary=*")
+        self.posts += 1
+        self._pending[TOTAL] += 1
+        for key in found:
+            self.counts[key] += 1
+            self._pending[key] += 1
+
+    @staticmethod
+    def _today() -> datetime.datetime:
+        return datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        day = self._today()
+        terms = list(pending)
+        requests = [
+            UpdateOne({"term": term, "day": day}, {"$inc": {"posts": pending[term]}}, upsert=True)
+            for term in terms
+        ]
+        try:
+            await self.stats_col.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # Неудачные счётчики вернутся со следующей записью, удачные уже учтены
+            for err in e.details.get("writeErrors", []):
+                term = terms[err["index"]]
+                self._pending[term] += pending[term]
+            raise
+        except PyMongoError:
+            self._pending.update(pending)
+            raise
+        self.flushes += 1
+
+    async def load(self):
+        # Суммы за окно по всем процессам плюс ещё не записанные счётчики этого процесса
+        since = self._today() - datetime.timedelta(days=self.window_days - 1)
+        counts: Counter = Counter()
+        async for doc in self.stats_col.aggregate([
+            {"$match": {"day": {"$gte": since}}},
+            {"$group": {"_id": "$term", "posts": {"$sum": "$posts"}}},
+        ]):
+            counts[doc["_id"]] = doc["posts"]
+        counts.update(self._pending)
+        self.posts = counts.pop(TOTAL, 0)
+        self.counts = counts
+        self.loaded_at = datetime.datetime.utcnow()
+
+    def frequencies(self) -> dict[str, float]:
+        # Пока постов мало, оценки случайны: фильтры проверяются в порядке пользователя
+        if self.posts < self.min_posts:
+            return {}
+        return {term: count / self.posts for term, count in self.counts.items()}
+
+    def report(self, vocabulary, limit: int = 10) -> tuple[list, list]:
+        # Самые избирательные (редкие) и самые частые ключи фильтров с числом постов
+        ranked = sorted((self.counts.get(key, 0), key) for key in vocabulary)
+        rare = [(key, count) for count, key in ranked[:limit]]
+        common = [(key, count) for count, key in reversed(ranked[-limit:])]
+        return rare, common
+
+    def stats(self) -> dict:
+        return {
+            "posts": self.posts,
+            "keywords": len(self.counts),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+        }
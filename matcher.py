@@ -0,0 +1,322 @@
+from bisect import bisect_left, bisect_right
+from rapidfuzz import fuzz, process
+from extract import CATEGORICAL
+from filters import CompiledFilter, PreparedText, compile_filters, prepare_text, FUZZY_MIN_LENGTH
+
+
+class FuzzyIndex:
+    # Нечёткое сравнение токенов поста со словарём ключевых слов всех пользователей.
+    # Токены сравниваются пакетом через cdist, результат кэшируется между постами.
+    def __init__(self, score_cutoff: int = 80, workers: int = -1, cache_size: int = 50000):
+        self.score_cutoff = score_cutoff
+        self.workers = workers
+        self.cache_size = cache_size
+        self.vocabulary: list[str] = []
+        self._cache: dict[str, tuple[str, ...]] = {}
+
+    def rebuild(self, keywords):
+        self.vocabulary = sorted(keywords)
+        self._cache.clear()
+
+    def lookup(self, tokens) -> set[str]:
+        found = set()
+        if not self.vocabulary:
+            return found
+
+        missing = []
+        for token in tokens:
+            cached = self._cache.get(token)
+            if cached is None:
+                missing.append(token)
+            else:
+                found.update(cached)
+        if not missing:
+            return found
+
+        scores = process.cdist(
+            missing, self.vocabulary,
+            scorer=fuzz.ratio,
+            score_cutoff=self.score_cutoff,
+            workers=self.workers
+        )
+        result = {token: [] for token in missing}
+        rows, cols = scores.nonzero()
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            result[missing[row]].append(self.vocabulary[col])
+
+        if len(self._cache) + len(result) > self.cache_size:
+            self._cache.clear()
+        for token, keywords in result.items():
+            self._cache[token] = tuple(keywords)
+            found.update(keywords)
+        return found
+
+
+class SalaryIndex(dict):
+    # (валюта, оператор, порог) -> позиции; пороги каждой пары (валюта, оператор) отсортированы,
+    # так что для поста находятся бинарным поиском, без перебора всех условий
+    def __init__(self):
+        super().__init__()
+        self._sorted: dict[tuple[str, str], list] = {}
+        self._dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._dirty = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._dirty = True
+
+    def lookup(self, salary: dict):
+        if self._dirty:
+            self._sorted = {}
+            for currency, op, threshold in self:
+                self._sorted.setdefault((currency, op), []).append(threshold)
+            for thresholds in self._sorted.values():
+                thresholds.sort()
+            self._dirty = False
+        currency = salary["currency"]
+        top = salary.get("max", salary.get("min", 0))
+        bottom = salary.get("min", salary.get("max", 0))
+        at_least = self._sorted.get((currency, ">="), ())
+        for threshold in at_least[:bisect_right(at_least, top)]:
+            yield self[(currency, ">=", threshold)]
+        at_most = self._sorted.get((currency, "<="), ())
+        for threshold in at_most[bisect_left(at_most, bottom):]:
+            yield self[(currency, "<=", threshold)]
+
+
+def count_keys(vocabulary: dict[str, int], compiled, delta: int):
+    # Словарь ключей всех фильтров со счётчиком ссылок: по нему собирается статистика частот
+    for user_filter in compiled:
+        for key in user_filter.stat_keys():
+            count = vocabulary.get(key, 0) + delta
+            if count > 0:
+                vocabulary[key] = count
+            else:
+                vocabulary.pop(key, None)
+
+
+class MatchEngine:
+    # Глобальный индекс: основа ключевого слова (со всеми синонимами) -> (пользователь, фильтр, группа).
+    # Пост разбирается один раз, каждое слово и фраза поста - один поиск в словаре,
+    # стоимость зависит от длины текста и числа совпадений, а не от количества пользователей.
+    # Когда известны частоты слов (reorder), фильтр из нескольких групп индексируется только
+    # по самой редкой группе, остальные проверяются у найденных кандидатов в порядке избирательности.
+    def __init__(self, fuzzy_cutoff: int = 80, fuzzy_workers: int = -1):
+        self.postings: dict[str, set[tuple[int, int, int]]] = {}
+        self.fuzzy_postings: dict[str, set[tuple[int, int, int]]] = {}
+        # Условия на структурные поля: «field=value» -> позиции и отдельный индекс зарплат
+        self.field_postings: dict[str, set[tuple[int, int, int]]] = {}
+        self.salary_postings = SalaryIndex()
+        # Исключения: основа или условие -> (пользователь, фильтр), которые пост с ним не проходит
+        self.exclusions: dict[str, set[tuple[int, int]]] = {}
+        self.excluded_fields: dict[str, set[tuple[int, int]]] = {}
+        self.excluded_salaries = SalaryIndex()
+        self.fuzzy = FuzzyIndex(fuzzy_cutoff, fuzzy_workers)
+        self._fuzzy_dirty = False
+        self.required: dict[tuple[int, int], int] = {}
+        self.match_all: set[tuple[int, int]] = set()
+        self.verify: set[tuple[int, int]] = set()
+        self.frequencies: dict[str, float] = {}
+        self.vocabulary: dict[str, int] = {}
+        self.verified = 0
+        self.user_filters: dict[int, tuple[CompiledFilter, ...]] = {}
+        self.user_postings: dict[int, list[tuple[dict, str, tuple[int, int, int]]]] = {}
+        self.max_phrase = 1
+        self._phrases_dirty = False
+
+    def __len__(self):
+        return len(self.user_filters)
+
+    def set_user_filters(self, user_id: int, filters_list: list[list[list[str]]]):
+        self.remove_user(user_id)
+        if not filters_list:
+            return
+
+        compiled = compile_filters(filters_list)
+        user_postings = []
+        for fi, user_filter in enumerate(compiled):
+            user_filter.reorder(self.frequencies)
+            # Длина фраз - по всему фильтру: неиндексированные группы проверяются по prepared.terms
+            self.max_phrase = max(self.max_phrase, user_filter.max_phrase)
+            # Нечёткие слова проверяются только через индекс, такие фильтры индексируются целиком
+            driven = bool(self.frequencies) and len(user_filter.groups) > 1 and not user_filter.fuzzy
+            for gi in user_filter.order[:1] if driven else range(len(user_filter.groups)):
+                variants = user_filter.groups[gi]
+                posting = (user_id, fi, gi)
+                for variant in variants:
+                    if variant not in self.postings:
+                        self.postings[variant] = set()
+                    self.postings[variant].add(posting)
+                    user_postings.append((self.postings, variant, posting))
+                for variant in user_filter.fuzzy_groups[gi]:
+                    if variant not in self.fuzzy_postings:
+                        self.fuzzy_postings[variant] = set()
+                        self._fuzzy_dirty = True
+                    self.fuzzy_postings[variant].add(posting)
+                    user_postings.append((self.fuzzy_postings, variant, posting))
+                for predicate in user_filter.predicates[gi]:
+                    self._add_predicate(predicate, posting, user_postings)
+            for variant in user_filter.excluded:
+                if variant not in self.exclusions:
+                    self.exclusions[variant] = set()
+                self.exclusions[variant].add((user_id, fi))
+                user_postings.append((self.exclusions, variant, (user_id, fi)))
+            for predicate in user_filter.excluded_predicates:
+                self._add_predicate(predicate, (user_id, fi), user_postings, excluded=True)
+            if driven:
+                self.required[(user_id, fi)] = 1
+                self.verify.add((user_id, fi))
+            elif user_filter.groups:
+                self.required[(user_id, fi)] = len(user_filter.groups)
+            else:
+                self.match_all.add((user_id, fi))
+
+        self.user_filters[user_id] = compiled
+        self.user_postings[user_id] = user_postings
+        count_keys(self.vocabulary, compiled, 1)
+
+    def _add_predicate(self, predicate, posting: tuple, user_postings: list, excluded: bool = False):
+        if predicate.field == "salary":
+            index = self.excluded_salaries if excluded else self.salary_postings
+            key = (predicate.currency, predicate.op, predicate.value)
+        else:
+            index = self.excluded_fields if excluded else self.field_postings
+            key = predicate.key
+        if key not in index:
+            index[key] = set()
+        index[key].add(posting)
+        user_postings.append((index, key, posting))
+
+    def reorder(self, frequencies: dict[str, float]):
+        # Переиндексируем только пользователей, у которых поменялся порядок групп
+        self.frequencies = frequencies
+        changed = [
+            user_id for user_id, compiled in self.user_filters.items()
+            if any(f.order != f.selectivity_order(frequencies) for f in compiled)
+        ]
+        for user_id in changed:
+            self.set_user_filters(user_id, [f.source for f in self.user_filters[user_id]])
+        return len(changed)
+
+    def remove_user(self, user_id: int):
+        filters_list = self.user_filters.pop(user_id, None)
+        if filters_list is None:
+            return
+        for index, pattern, posting in self.user_postings.pop(user_id, ()):
+            postings = index.get(pattern)
+            if postings is None:
+                continue
+            postings.discard(posting)
+            if not postings:
+                del index[pattern]
+                if index is self.fuzzy_postings:
+                    self._fuzzy_dirty = True
+        if any(f.max_phrase > 1 for f in filters_list):
+            self._phrases_dirty = True
+        for fi in range(len(filters_list)):
+            self.required.pop((user_id, fi), None)
+            self.match_all.discard((user_id, fi))
+            self.verify.discard((user_id, fi))
+        count_keys(self.vocabulary, filters_list, -1)
+
+    def prepare(self, text: str, fields: dict | None = None) -> PreparedText:
+        if self._phrases_dirty:
+            self.max_phrase = max(
+                (f.max_phrase for compiled in self.user_filters.values() for f in compiled), default=1
+            )
+            self._phrases_dirty = False
+        return prepare_text(text, self.max_phrase, fields)
+
+    def set_many(self, items):
+        for user_id, filters_list in items:
+            self.set_user_filters(user_id, filters_list)
+
+    def close(self):
+        pass
+
+    def match(self, text: str) -> dict[int, CompiledFilter]:
+        return self.match_prepared(self.prepare(text))
+
+    def match_prepared(self, prepared: PreparedText) -> dict[int, CompiledFilter]:
+        # Возвращает для каждого подходящего пользователя первый сработавший фильтр
+        return {
+            user_id: self.user_filters[user_id][fi]
+            for user_id, fi in self.match_indices(prepared).items()
+        }
+
+    async def match_batch(self, prepared_list: list[PreparedText]) -> list[dict[int, CompiledFilter]]:
+        return [self.match_prepared(prepared) for prepared in prepared_list]
+
+    def excluded_by(self, prepared: PreparedText) -> set[tuple[int, int]]:
+        # Фильтры, которые пост не проходит из-за слова или условия с «-»
+        excluded = set()
+        if self.exclusions:
+            for term in prepared.terms:
+                matched = self.exclusions.get(term)
+                if matched:
+                    excluded.update(matched)
+        fields = prepared.fields
+        if fields and (self.excluded_fields or self.excluded_salaries):
+            for field in CATEGORICAL:
+                for value in fields.get(field, ()):
+                    matched = self.excluded_fields.get(f"{field}={value}")
+                    if matched:
+                        excluded.update(matched)
+            if fields.get("salary") and self.excluded_salaries:
+                for matched in self.excluded_salaries.lookup(fields["salary"]):
+                    excluded.update(matched)
+        return excluded
+
+    def match_indices(self, prepared: PreparedText) -> dict[int, int]:
+        # Номер первого сработавшего фильтра для каждого подходящего пользователя
+        hits: dict[tuple[int, int], set[int]] = {}
+        postings = self.postings
+        for term in prepared.terms:
+            matched = postings.get(term)
+            if matched:
+                for user_id, fi, gi in matched:
+                    hits.setdefault((user_id, fi), set()).add(gi)
+
+        if self.fuzzy_postings:
+            if self._fuzzy_dirty:
+                self.fuzzy.rebuild(self.fuzzy_postings)
+                self._fuzzy_dirty = False
+            tokens = [t for t in prepared.words if len(t) >= FUZZY_MIN_LENGTH - 1]
+            for keyword in self.fuzzy.lookup(tokens):
+                for user_id, fi, gi in self.fuzzy_postings[keyword]:
+                    hits.setdefault((user_id, fi), set()).add(gi)
+
+        fields = prepared.fields
+        if fields and (self.field_postings or self.salary_postings):
+            matched_sets = [
+                self.field_postings.get(f"{field}={value}")
+                for field in CATEGORICAL for value in fields.get(field, ())
+            ]
+            if fields.get("salary") and self.salary_postings:
+                matched_sets.extend(self.salary_postings.lookup(fields["salary"]))
+            for matched in matched_sets:
+                if matched:
+                    for user_id, fi, gi in matched:
+                        hits.setdefault((user_id, fi), set()).add(gi)
+
+        excluded = self.excluded_by(prepared)
+        best: dict[int, int] = {}
+        for key in self.match_all:
+            user_id, fi = key
+            if fi < best.get(user_id, fi + 1) and key not in excluded:
+                best[user_id] = fi
+        verify = self.verify
+        for key, groups in hits.items():
+            if len(groups) == self.required[key]:
+                user_id, fi = key
+                if fi >= best.get(user_id, fi + 1) or key in excluded:
+                    continue
+                if key in verify:
+                    self.verified += 1
+                    if not self.user_filters[user_id][fi].matches(prepared):
+                        continue
+                best[user_id] = fi
+        return best
@@ -0,0 +1,112 @@
+import asyncio
+import bisect
+import os
+from collections import Counter
+
+# Выключенные метрики не пишутся: observe() становится пустым вызовом
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    # Гистограмма с фиксированными корзинами: дешёвая запись, приблизительные перцентили
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+        }
+
+
+class NullHistogram(Histogram):
+    __slots__ = ()
+
+    def observe(self, value: float):
+        pass
+
+
+def histogram(buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+    return Histogram(buckets) if ENABLED else NullHistogram(buckets)
+
+
+# Ошибки по месту возникновения; раньше они уходили только в print
+errors: Counter = Counter()
+# Последовательные проверки фильтров: сколько фильтров проверено и сколько групп в них просмотрено
+filter_checks: Counter = Counter()
+
+
+def _metric_name(*parts) -> str:
+    return "_".join(str(p) for p in parts if p != "").replace(".", "_").replace("-", "_").lower()
+
+
+def render_prometheus(sections: dict, prefix: str = "devradar") -> str:
+    # Числа - gauge, снимки гистограмм - summary с квантилями p50/p99
+    lines = []
+    for section, values in sections.items():
+        for key, value in values.items():
+            name = _metric_name(prefix, section, key)
+            if isinstance(value, bool) or value is None:
+                continue
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+            elif isinstance(value, dict) and "p50" in value:
+                lines.append(f"# TYPE {name} summary")
+                lines.append(f'{name}{{quantile="0.5"}} {value["p50"]}')
+                lines.append(f'{name}{{quantile="0.99"}} {value["p99"]}')
+                lines.append(f"{name}_sum {value['avg'] * value['count']}")
+                lines.append(f"{name}_count {value['count']}")
+            elif isinstance(value, dict):
+                lines.append(f"# TYPE {name} gauge")
+                for label, item in value.items():
+                    if isinstance(item, (int, float)) and not isinstance(item, bool):
+                        lines.append(f'{name}{{key="{label}"}} {item}')
+    return "\n".join(lines) + "\n"
+
+
+async def serve_prometheus(collect, host: str, port: int):
+    # Минимальный HTTP-сервер на asyncio: любой GET отдаёт текущие метрики
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render_prometheus(collect()).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,247 @@
+import asyncio
+import datetime
+from pymongo.errors import BulkWriteError, PyMongoError
+from dedup import BloomFilter
+from delivery import Delivery
+from filters import CompiledFilter
+from metrics import errors
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class Outbox:
+    # Совпадения пишутся в outbox одной вставкой до постановки в очередь рассылки.
+    # Отправленные записи удаляются из outbox и попадают в журнал delivered (TTL-коллекция)
+    # пачками раз в flush_interval; Bloom-фильтр в памяти отвечает на «не доставлено» без запроса к базе.
+    # Доставка, упавшая после всех повторов, остаётся в outbox со счётчиком attempts и отправляется
+    # снова при следующем resume; после max_attempts неудачных попыток запись снимается с учётом в abandoned.
+    def __init__(self, outbox_col, ledger_col, bloom_capacity: int = 1_000_000,
+                 flush_interval: float = 1.0, flush_size: int = 500, max_attempts: int = 3):
+        self.outbox_col = outbox_col
+        self.ledger_col = ledger_col
+        self.bloom = BloomFilter(bloom_capacity)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_attempts = max_attempts
+        self._done: list[str] = []
+        self._delivered: dict[str, datetime.datetime] = {}
+        self._failed: list[str] = []
+        self._task = None
+        self._flush_task = None
+
+        self.added = 0
+        self.resumed = 0
+        self.flushes = 0
+        self.ledger_checks = 0
+        self.false_positives = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    async def load(self):
+        async for doc in self.ledger_col.find({}, {"_id": 1}):
+            self.bloom.add(doc["_id"])
+        print(f"Журнал доставок: {len(self.bloom)} записей")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flush_task:
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            errors["outbox"] += 1
+            print(f"Ошибка записи журнала доставок: {e}")
+
+    async def add(self, deliveries: list[Delivery]) -> list[Delivery]:
+        # Возвращает доставки, которых ещё не было в outbox: уже записанные
+        # после сбоя рассылаются через resume, повторно в очередь их ставить не нужно
+        now = datetime.datetime.utcnow()
+        keyed = [delivery for delivery in deliveries if delivery.key]
+        records = [
+            {
+                "_id": delivery.key,
+                "chat_id": delivery.chat_id,
+                "from_chat_id": delivery.from_chat_id,
+                "message_id": delivery.message_id,
+                "channel_title": delivery.channel_title,
+                "post_link": delivery.post_link,
+                "filter": delivery.user_filter.source if delivery.user_filter else None,
+                "created_at": now,
+            }
+            for delivery in keyed
+        ]
+        if not records:
+            return deliveries
+        existing = set()
+        try:
+            await self.outbox_col.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") == DUPLICATE_KEY_ERROR:
+                    existing.add(err["index"])
+                else:
+                    errors["outbox"] += 1
+                    print(f"Не удалось записать outbox: {err.get('errmsg')}")
+        self.added += len(records) - len(existing)
+        if not existing:
+            return deliveries
+        skip = {keyed[i].key for i in existing}
+        return [delivery for delivery in deliveries if delivery.key not in skip]
+
+    async def delivered(self, delivery: Delivery) -> bool:
+        key = delivery.key
+        if key is None or key not in self.bloom:
+            return False
+        if key in self._delivered:
+            return True
+        self.ledger_checks += 1
+        if await self.ledger_col.find_one({"_id": key}, {"_id": 1}):
+            return True
+        self.false_positives += 1
+        return False
+
+    def ack(self, delivery: Delivery, sent: bool):
+        # Запись в базу откладывается до flush: одна пачка вместо двух запросов на доставку
+        key = delivery.key
+        if key is None:
+            return
+        self._done.append(key)
+        if sent:
+            self._delivered[key] = datetime.datetime.utcnow()
+            self.bloom.add(key)
+        if len(self._done) >= self.flush_size and not (self._flush_task and not self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_logged())
+
+    def fail(self, delivery: Delivery):
+        # Отправка не удалась после всех повторов: запись остаётся в outbox для следующего resume
+        if delivery.key is not None:
+            self._failed.append(delivery.key)
+            self.failed += 1
+
+    def _restore(self, done: list, delivered: dict, failed: list):
+        self._done = done + self._done
+        self._delivered = {**delivered, **self._delivered}
+        self._failed = failed + self._failed
+
+    async def flush(self):
+        if not self._done and not self._delivered and not self._failed:
+            return
+        done, self._done = self._done, []
+        delivered, self._delivered = self._delivered, {}
+        failed, self._failed = self._failed, []
+        # Сначала журнал, потом удаление из outbox: при сбое между ними запись
+        # вернётся из outbox, но журнал не даст отправить её повторно.
+        # Ключи, которые не удалось записать, возвращаются в буферы до следующего flush
+        try:
+            if delivered:
+                keys = list(delivered)
+                try:
+                    await self.ledger_col.insert_many(
+                        [{"_id": key, "at": delivered[key]} for key in keys], ordered=False
+                    )
+                except BulkWriteError as e:
+                    rejected = [err for err in e.details.get("writeErrors", [])
+                                if err.get("code") != DUPLICATE_KEY_ERROR]
+                    if rejected:
+                        errors["outbox"] += 1
+                        print(f"Не удалось записать журнал доставок: {rejected[0].get('errmsg')}")
+                        retry = {keys[err["index"]] for err in rejected}
+                        self._restore([key for key in done if key in retry],
+                                      {key: delivered[key] for key in retry}, [])
+                        done = [key for key in done if key not in retry]
+                        delivered = {key: at for key, at in delivered.items() if key not in retry}
+            if done:
+                await self.outbox_col.delete_many({"_id": {"$in": done}})
+            done, delivered = [], {}
+            if failed:
+                await self.outbox_col.update_many(
+                    {"_id": {"$in": failed}},
+                    {"$inc": {"attempts": 1}, "$set": {"failed_at": datetime.datetime.utcnow()}}
+                )
+        except PyMongoError:
+            # Записи журнала идемпотентны: повторная вставка даст только дубликаты ключей
+            self._restore(done, delivered, failed)
+            raise
+        self.flushes += 1
+
+    async def resume(self, delivery_queue, store, query: dict | None = None) -> int:
+        # Незавершённые записи после перезапуска: текст берём один раз на пост
+        texts: dict[tuple[int, int], str | None] = {}
+        resumed = 0
+        chunk = []
+        async for record in self.outbox_col.find(query or {}).sort("created_at", 1):
+            chunk.append(record)
+            if len(chunk) >= self.flush_size:
+                resumed += await self._resume_chunk(chunk, delivery_queue, store, texts)
+                chunk = []
+        if chunk:
+            resumed += await self._resume_chunk(chunk, delivery_queue, store, texts)
+        self.resumed += resumed
+        if resumed:
+            print(f"Возобновлена рассылка {resumed} уведомлений из outbox")
+        return resumed
+
+    async def _resume_chunk(self, records: list[dict], delivery_queue, store, texts: dict) -> int:
+        # Запись могла попасть в журнал другим процессом (упал между записью журнала и удалением из outbox):
+        # его Bloom-фильтр нам неизвестен, поэтому проверяем по базе
+        keys = [record["_id"] for record in records]
+        delivered = {doc["_id"] async for doc in self.ledger_col.find({"_id": {"$in": keys}}, {"_id": 1})}
+        stale = list(delivered)
+        resumed = 0
+        for record in records:
+            if record["_id"] in delivered:
+                self.bloom.add(record["_id"])
+                continue
+            if record.get("attempts", 0) >= self.max_attempts:
+                self.abandoned += 1
+                print(f"Уведомление {record['_id']} не отправлено за {record['attempts']} попыток, снято из outbox")
+                stale.append(record["_id"])
+                continue
+            post_key = (record["from_chat_id"], record["message_id"])
+            if post_key not in texts:
+                texts[post_key] = await store.get_text(*post_key)
+            text = texts[post_key]
+            if text is None:
+                stale.append(record["_id"])
+                continue
+            await delivery_queue.put(Delivery(
+                chat_id=record["chat_id"],
+                from_chat_id=record["from_chat_id"],
+                message_id=record["message_id"],
+                text=text,
+                channel_title=record.get("channel_title"),
+                post_link=record.get("post_link"),
+                user_filter=CompiledFilter(record["filter"]) if record.get("filter") else None
+            ))
+            resumed += 1
+        if stale:
+            await self.outbox_col.delete_many({"_id": {"$in": stale}})
+        return resumed
+
+    def stats(self) -> dict:
+        return {
+            "added": self.added,
+            "resumed": self.resumed,
+            "pending_acks": len(self._done),
+            "failed": self.failed,
+            "abandoned": self.abandoned,
+            "flushes": self.flushes,
+            "ledger_size": len(self.bloom),
+            "ledger_checks": self.ledger_checks,
+            "bloom_false_positives": self.false_positives,
+        }
@@ -0,0 +1,353 @@
+import asyncio
+import datetime
+import time
+from pymongo.errors import BulkWriteError
+from delivery import Delivery
+from dedup import minhash, similarity
+from digest import preview
+from metrics import histogram, errors
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+DUPLICATE_KEY_ERROR = 11000
+
+
+def post_link(channel_id: int, channel_username: str | None, message_id: int) -> str:
+    if channel_username:
+        username = channel_username.lstrip('@')
+        return f"https://t.me/{username}/{message_id}"
+    channel_id_num = str(channel_id).replace('-100', '')
+    return f"https://t.me/c/{channel_id_num}/{message_id}"
+
+
+class IncomingPost:
+    __slots__ = ("channel_id", "channel_username", "channel_title", "message_id", "text",
+                 "received_at", "prepared", "signature", "cluster", "doc_id")
+
+    def __init__(self, channel_id, channel_username, channel_title, message_id, text):
+        self.channel_id = channel_id
+        self.channel_username = channel_username
+        self.channel_title = channel_title
+        self.message_id = message_id
+        self.text = text
+        self.received_at = time.monotonic()
+        self.prepared = None
+        self.signature = None
+        self.cluster = None
+        self.doc_id = None
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return (self.channel_id, self.message_id)
+
+    def to_document(self) -> dict:
+        # Постоянная запись без текста: текст хранится отдельно (см. storage.PostStore)
+        doc = {
+            "channel_id": self.channel_id,
+            "message_id": self.message_id,
+            "processed_at": datetime.datetime.utcnow()
+        }
+        if self.signature:
+            doc["signature"] = self.signature
+        if self.cluster:
+            doc["cluster"] = list(self.cluster)
+        if self.prepared is not None and self.prepared.fields:
+            doc["fields"] = self.prepared.fields
+        return doc
+
+
+class IngestPipeline:
+    # Обработчик апдейта только ставит пост в очередь. Сборщик копит посты в течение
+    # окна или до лимита размера и обрабатывает пачку целиком:
+    # дедупликация -> одна вставка insert_many -> сопоставление -> outbox -> очередь рассылки.
+    def __init__(self, store, subscribers, delivery_queue, recent_posts, near_duplicates,
+                 window: float = 0.2, max_size: int = 100, maxsize: int = 10000, digests=None,
+                 outbox=None, routing: bool = True, keyword_stats=None):
+        self.store = store
+        self.outbox = outbox
+        # Частоты ключевых слов считаются по каждому новому посту один раз, в приёмном процессе
+        self.keyword_stats = keyword_stats
+        # Без routing пачка только сохраняется: сопоставляют и рассылают процессы-воркеры (см. workers.py)
+        self.routing = routing
+        self.subscribers = subscribers
+        self.delivery_queue = delivery_queue
+        self.recent_posts = recent_posts
+        self.near_duplicates = near_duplicates
+        self.digests = digests
+        self.window = window
+        self.max_size = max_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task = None
+        # Пачка, которую собирает _run, и её обработка: при остановке ничего из них не теряем
+        self._batch: list[IncomingPost] = []
+        self._processing = None
+
+        self.batches = 0
+        self.posts = 0
+        self.duplicates = 0
+        self.recovered = 0
+        self.batch_size = histogram(BATCH_SIZE_BUCKETS)
+        self.stage_latency = {
+            stage: histogram()
+            for stage in ("wait", "dedup", "persist", "match", "enqueue", "total")
+        }
+
+    async def submit(self, post: IncomingPost):
+        await self.queue.put(post)
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._processing:
+            # Начатую пачку доводим до конца: прерванная после вставки осталась бы неразосланной
+            try:
+                await self._processing
+            except Exception as e:
+                errors["pipeline"] += 1
+                print(f"Ошибка обработки пачки постов при остановке: {e}")
+            self._processing = None
+        batch, self._batch = self._batch, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self.process(batch)
+
+    async def _collect(self) -> list[IncomingPost]:
+        batch = self._batch
+        batch.append(await self.queue.get())
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._batch = []
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # shield: отмена задачи не обрывает обработку, её дожидается stop()
+            self._processing = asyncio.ensure_future(self.process(batch))
+            try:
+                await asyncio.shield(self._processing)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors["pipeline"] += 1
+                print(f"Ошибка обработки пачки постов ({len(batch)}): {e}")
+            self._processing = None
+
+    def _observe(self, stage: str, started: float) -> float:
+        now = time.monotonic()
+        self.stage_latency[stage].observe(now - started)
+        return now
+
+    async def process(self, batch: list[IncomingPost]):
+        started = time.monotonic()
+        for post in batch:
+            self.stage_latency["wait"].observe(started - post.received_at)
+        self.batches += 1
+        self.batch_size.observe(len(batch))
+
+        fresh = []
+        seen = set()
+        for post in batch:
+            if post.key in seen or post.key in self.recent_posts:
+                self.duplicates += 1
+                continue
+            seen.add(post.key)
+            fresh.append(post)
+        pending = []
+        for post in fresh:
+            post.prepared = self.subscribers.prepare(post.text)
+            self.near_duplicate_check(post, pending)
+        stage = self._observe("dedup", started)
+
+        stored = await self.persist(fresh)
+        # В индекс похожих попадают только сохранённые посты: отклонённые базой не станут оригиналами кластеров
+        now = time.time()
+        for post in stored:
+            if post.signature is not None:
+                self.near_duplicates.add(post.key, post.signature, now, post.cluster)
+        if self.keyword_stats:
+            vocabulary = self.subscribers.vocabulary
+            for post in stored:
+                self.keyword_stats.observe(post.prepared, vocabulary)
+        stage = self._observe("persist", stage)
+        if not self.routing:
+            self.stage_latency["total"].observe(stage - started)
+            return
+
+        deliveries, digest_entries = await self.match(stored)
+        stage = self._observe("match", stage)
+
+        await self.enqueue(stored, deliveries, digest_entries)
+        stage = self._observe("enqueue", stage)
+        self.stage_latency["total"].observe(stage - started)
+
+    async def match(self, posts: list[IncomingPost]) -> tuple[list[Delivery], list]:
+        deliveries = []
+        digest_entries = []
+        results = await self.subscribers.match_batch([post.prepared for post in posts]) if posts else []
+        for post, matches in zip(posts, results):
+            instant, digest = await self.route(post, matches)
+            deliveries.extend(instant)
+            digest_entries.extend(digest)
+        return deliveries, digest_entries
+
+    async def enqueue(self, posts: list[IncomingPost], deliveries: list[Delivery], digest_entries: list):
+        if self.outbox:
+            # Сначала outbox, потом снимаем отметку routed: после сбоя пост либо
+            # сопоставится заново, либо его рассылка продолжится из outbox
+            deliveries = await self.outbox.add(deliveries)
+        if digest_entries:
+            await self.digests.add_many(digest_entries)
+        doc_ids = [post.doc_id for post in posts if post.doc_id is not None]
+        if self.outbox and doc_ids:
+            await self.store.posts_col.update_many({"_id": {"$in": doc_ids}}, {"$unset": {"routed": ""}})
+        for delivery in deliveries:
+            await self.delivery_queue.put(delivery)
+
+    async def recover(self) -> int:
+        # Посты, сохранённые, но не дошедшие до outbox (процесс упал между вставкой и сопоставлением)
+        if not self.outbox or not self.routing:
+            return 0
+        posts = []
+        async for doc in self.store.posts_col.find({"routed": False}):
+            saved = await self.store.texts_col.find_one(
+                {"channel_id": doc["channel_id"], "message_id": doc["message_id"]},
+                {"channel_username": 1, "channel_title": 1, "text": 1}
+            )
+            text = saved.get("text") if saved else await self.store.get_text(doc["channel_id"], doc["message_id"])
+            post = IncomingPost(doc["channel_id"], (saved or {}).get("channel_username"),
+                                (saved or {}).get("channel_title"), doc["message_id"], text or "")
+            post.doc_id = doc["_id"]
+            post.signature = doc.get("signature")
+            post.cluster = tuple(doc["cluster"]) if doc.get("cluster") else None
+            post.prepared = self.subscribers.prepare(post.text, doc.get("fields"))
+            posts.append(post)
+        for i in range(0, len(posts), self.max_size):
+            batch = posts[i:i + self.max_size]
+            deliveries, digest_entries = await self.match(batch)
+            await self.enqueue(batch, deliveries, digest_entries)
+        self.recovered += len(posts)
+        if posts:
+            print(f"Повторно сопоставлено постов после сбоя: {len(posts)}")
+        return len(posts)
+
+    def near_duplicate_check(self, post: IncomingPost, pending: list):
+        # Та же вакансия, перепощенная в другом канале. pending - подписи и кластеры
+        # предыдущих постов пачки: в индекс они попадут только после сохранения
+        index = self.near_duplicates
+        if len(post.prepared.stems) < index.min_tokens:
+            return
+        post.signature = minhash(post.prepared.stems)
+        post.cluster = index.find(post.signature, time.time())
+        if post.cluster is None:
+            for signature, cluster in pending:
+                if similarity(signature, post.signature) >= index.threshold:
+                    index.duplicates += 1
+                    post.cluster = cluster
+                    break
+        pending.append((post.signature, post.cluster or post.key))
+
+    async def persist(self, posts: list[IncomingPost]) -> list[IncomingPost]:
+        # Уникальный индекс (channel_id, message_id) отсекает уже виденные посты прямо при вставке
+        if not posts:
+            return []
+        rejected = set()
+        failed = set()
+        records = [self.store.record(post) for post in posts]
+        if self.outbox and self.routing:
+            for record in records:
+                record["routed"] = False
+        try:
+            await self.store.posts_col.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                rejected.add(error["index"])
+                if error.get("code") != DUPLICATE_KEY_ERROR:
+                    failed.add(error["index"])
+                    errors["persist"] += 1
+                    print(f"Не удалось сохранить пост: {error.get('errmsg')}")
+        stored = []
+        stored_records = []
+        for i, post in enumerate(posts):
+            if i in failed:
+                # Не сохранён из-за ошибки базы: не считаем виденным, повтор поста его сохранит
+                continue
+            self.recent_posts.add(post.key)
+            if i in rejected:
+                self.duplicates += 1
+            else:
+                post.doc_id = records[i].get("_id")
+                stored.append(post)
+                stored_records.append(records[i])
+        await self.store.save_texts(stored, stored_records)
+        self.posts += len(stored)
+        return stored
+
+    async def cluster_recipients(self, cluster: tuple) -> set:
+        # Кому уже ушёл пост-оригинал; после перезапуска пересчитываем по его тексту
+        recipients = self.near_duplicates.recipients.get(cluster)
+        if recipients is None:
+            text = await self.store.get_text(cluster[0], cluster[1])
+            recipients = set(await self.subscribers.match(text)) if text else set()
+            self.near_duplicates.remember(cluster, recipients, time.time())
+        return recipients
+
+    async def route(self, post: IncomingPost, matches: dict) -> tuple[list[Delivery], list]:
+        if post.cluster:
+            delivered = await self.cluster_recipients(post.cluster)
+            skipped = matches.keys() & delivered
+            self.near_duplicates.skipped_sends += len(skipped)
+            delivered.update(matches)
+            matches = {u: f for u, f in matches.items() if u not in skipped}
+        elif post.signature:
+            self.near_duplicates.remember(post.key, set(matches), time.time())
+
+        link = post_link(post.channel_id, post.channel_username, post.message_id)
+        modes = self.subscribers.modes if self.digests else {}
+        deliveries = []
+        digest = []
+        for user_id, user_filter in matches.items():
+            mode = modes.get(user_id)
+            if mode:
+                digest.append((user_id, mode, {
+                    "title": post.channel_title,
+                    "link": link,
+                    "preview": preview(post.text),
+                }))
+                continue
+            deliveries.append(Delivery(
+                chat_id=user_id,
+                from_chat_id=post.channel_id,
+                message_id=post.message_id,
+                text=post.text,
+                channel_title=post.channel_title,
+                post_link=link,
+                user_filter=user_filter
+            ))
+        return deliveries, digest
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth(),
+            "batches": self.batches,
+            "posts": self.posts,
+            "duplicates": self.duplicates,
+            "recovered": self.recovered,
+            "batch_size": self.batch_size.snapshot(),
+            **{f"{stage}_latency": h.snapshot() for stage, h in self.stage_latency.items()},
+        }
@@ -0,0 +1,274 @@
+import asyncio
+import datetime
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+from matcher import MatchEngine
+from digest import DIGEST_MODES
+
+# Запас окна refresh() на расхождение часов между процессами, пишущими updated_at
+REFRESH_OVERLAP = 30
+
+
+class SubscriberRegistry:
+    # Кэш активных пользователей и их фильтров в памяти процесса.
+    # Загружается один раз при старте, обновляется сквозной записью из обработчиков
+    # и (опционально) через change stream MongoDB, периодически сверяется с базой.
+    # Другие процессы видят изменения через refresh() по полю updated_at.
+    # shard=(index, count) - только пользователи с user_id % count == index (процесс-воркер).
+    # on_reactivated(user_id) - пользователь снова активен по данным базы (снять блокировку рассылки).
+    def __init__(self, users_col, engine=None, shard: tuple[int, int] | None = None, on_reactivated=None):
+        self.users_col = users_col
+        self.on_reactivated = on_reactivated
+        self.engine = engine if engine is not None else MatchEngine()
+        self.shard = shard
+        self.filters: dict[int, list] = {}
+        self.modes: dict[int, str] = {}
+        self.inactive: set[int] = set()
+        self._doc_ids = {}
+        self.loaded = False
+        self.synced_at = None
+        self.changed_at = None
+        # hits/misses - запросы фильтров пользователя из кэша и мимо него (get_filters)
+        self.hits = 0
+        self.misses = 0
+        self.matched_posts = 0
+        self.resyncs = 0
+        self.drift = 0
+        self.stream_events = 0
+        self.refreshed = 0
+
+    def __len__(self):
+        return len(self.filters)
+
+    def owns(self, user_id: int) -> bool:
+        return self.shard is None or user_id % self.shard[1] == self.shard[0]
+
+    def _query(self, query: dict) -> dict:
+        if self.shard is not None:
+            query["user_id"] = {"$mod": [self.shard[1], self.shard[0]]}
+        return query
+
+    def update_user(self, user_id: int, filters_list: list | None, doc_id=None):
+        if doc_id is not None:
+            self._doc_ids[doc_id] = user_id
+        self._apply([(user_id, filters_list)])
+
+    def _apply(self, changes: list):
+        for user_id, filters_list in changes:
+            if filters_list:
+                self.filters[user_id] = filters_list
+            else:
+                self.filters.pop(user_id, None)
+        self.engine.set_many(changes)
+
+    def set_mode(self, user_id: int, mode: str | None):
+        # Храним только пользователей с дайджестом, остальные получают посты сразу
+        if mode in DIGEST_MODES:
+            self.modes[user_id] = mode
+        else:
+            self.modes.pop(user_id, None)
+
+    async def deactivate(self, user_id: int):
+        # Бот заблокирован или чат удалён: пользователь выпадает из сопоставления
+        self.inactive.add(user_id)
+        self.update_user(user_id, None)
+        now = datetime.datetime.utcnow()
+        await self.users_col.update_one(
+            {"user_id": user_id},
+            {"$set": {"active": False, "deactivated_at": now, "updated_at": now}}
+        )
+
+    async def reactivate(self, user_id: int):
+        self.inactive.discard(user_id)
+        user = await self.users_col.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": {"active": True, "updated_at": datetime.datetime.utcnow()}, "$unset": {"deactivated_at": ""}},
+            {"filters_list": 1, "delivery_mode": 1}
+        )
+        if user:
+            self.update_user(user_id, user.get("filters_list"), user["_id"])
+            self.set_mode(user_id, user.get("delivery_mode"))
+
+    def get_filters(self, user_id: int):
+        filters_list = self.filters.get(user_id)
+        if filters_list is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return filters_list
+
+    @property
+    def vocabulary(self) -> dict[str, int]:
+        return self.engine.vocabulary
+
+    def reorder(self, frequencies: dict[str, float]):
+        # Порядок проверки групп по частотам ключевых слов (KeywordStats)
+        self.engine.reorder(frequencies)
+
+    def prepare(self, text: str, fields: dict | None = None):
+        return self.engine.prepare(text, fields)
+
+    async def match(self, text: str):
+        return (await self.match_batch([self.engine.prepare(text)]))[0]
+
+    async def match_batch(self, prepared_list: list):
+        self.matched_posts += len(prepared_list)
+        return await self.engine.match_batch(prepared_list)
+
+    async def _fetch(self):
+        snapshot = {}
+        doc_ids = {}
+        modes = {}
+        cursor = self.users_col.find(
+            self._query({"filters_list": {"$exists": True, "$ne": []}, "active": {"$ne": False}}),
+            {"user_id": 1, "filters_list": 1, "delivery_mode": 1}
+        )
+        async for user in cursor:
+            snapshot[user["user_id"]] = user["filters_list"]
+            doc_ids[user["_id"]] = user["user_id"]
+            if user.get("delivery_mode") in DIGEST_MODES:
+                modes[user["user_id"]] = user["delivery_mode"]
+        return snapshot, doc_ids, modes
+
+    async def _fetch_inactive(self) -> set[int]:
+        return {
+            user["user_id"] async for user in self.users_col.find(self._query({"active": False}), {"user_id": 1})
+        }
+
+    def _set_inactive(self, inactive: set[int]):
+        returned = self.inactive - inactive
+        self.inactive = inactive
+        if self.on_reactivated:
+            for user_id in returned:
+                self.on_reactivated(user_id)
+
+    async def load(self):
+        self.changed_at = datetime.datetime.utcnow()
+        snapshot, doc_ids, modes = await self._fetch()
+        changes = [(user_id, None) for user_id in self.filters if user_id not in snapshot]
+        changes.extend(snapshot.items())
+        self._apply(changes)
+        self._doc_ids = doc_ids
+        self.modes = modes
+        self.inactive = await self._fetch_inactive()
+        self.loaded = True
+        self.synced_at = time.monotonic()
+        print(f"Загружены фильтры пользователей: {len(self.filters)}")
+
+    async def resync(self):
+        # Сверка с базой на случай пропущенных событий: меняем только расхождения
+        snapshot, doc_ids, modes = await self._fetch()
+        changes = [(user_id, None) for user_id in self.filters if user_id not in snapshot]
+        changes.extend(
+            (user_id, filters_list) for user_id, filters_list in snapshot.items()
+            if self.filters.get(user_id) != filters_list
+        )
+        self._apply(changes)
+        changed = len(changes)
+        self._doc_ids = doc_ids
+        self.modes = modes
+        self._set_inactive(await self._fetch_inactive())
+        self.resyncs += 1
+        self.drift += changed
+        self.synced_at = time.monotonic()
+        if changed:
+            print(f"Сверка кэша пользователей: исправлено записей {changed}")
+
+    async def refresh(self):
+        # Изменения с прошлого опроса по updated_at: фильтры, режим и блокировки, записанные
+        # другими процессами. Окно берётся с запасом, уже применённые записи пропускаются
+        if self.changed_at is None:
+            return 0
+        since = self.changed_at - datetime.timedelta(seconds=REFRESH_OVERLAP)
+        latest = self.changed_at
+        changed = 0
+        cursor = self.users_col.find(
+            self._query({"updated_at": {"$gte": since}}),
+            {"user_id": 1, "filters_list": 1, "delivery_mode": 1, "active": 1, "updated_at": 1}
+        )
+        async for user in cursor:
+            latest = max(latest, user["updated_at"])
+            if self._apply_doc(user):
+                changed += 1
+        self.changed_at = latest
+        if changed:
+            self.refreshed += changed
+            self.synced_at = time.monotonic()
+        return changed
+
+    async def watch(self):
+        # Change stream нужен, когда фильтры меняют несколько процессов бота
+        resume_token = None
+        while True:
+            try:
+                async with self.users_col.watch(full_document="updateLookup",
+                                                resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._apply_change(change)
+            except OperationFailure as e:
+                print(f"Change stream недоступен, остаётся периодическая сверка: {e}")
+                return
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                print(f"Ошибка change stream, переподключение: {e}")
+                await asyncio.sleep(5)
+
+    def _apply_change(self, change: dict):
+        operation = change.get("operationType")
+        if operation in ("insert", "update", "replace"):
+            doc = change.get("fullDocument")
+            if doc and "user_id" in doc and self.owns(doc["user_id"]):
+                self._apply_doc(doc)
+        elif operation == "delete":
+            user_id = self._doc_ids.pop(change["documentKey"]["_id"], None)
+            if user_id is not None:
+                self.update_user(user_id, None)
+                self.set_mode(user_id, None)
+        else:
+            return
+        self.stream_events += 1
+        self.synced_at = time.monotonic()
+
+    def _apply_doc(self, doc: dict) -> bool:
+        # Документ пользователя из базы -> кэш; False, если кэш уже совпадал
+        user_id = doc["user_id"]
+        active = doc.get("active") is not False
+        filters_list = (doc.get("filters_list") or None) if active else None
+        mode = doc.get("delivery_mode")
+        self._doc_ids[doc["_id"]] = user_id
+        if (self.filters.get(user_id) == filters_list
+                and self.modes.get(user_id) == (mode if mode in DIGEST_MODES else None)
+                and (user_id in self.inactive) != active):
+            return False
+        self.update_user(user_id, filters_list)
+        self.set_mode(user_id, mode)
+        if active:
+            if user_id in self.inactive:
+                self.inactive.discard(user_id)
+                if self.on_reactivated:
+                    self.on_reactivated(user_id)
+        else:
+            self.inactive.add(user_id)
+        return True
+
+    def staleness(self) -> float | None:
+        if self.synced_at is None:
+            return None
+        return time.monotonic() - self.synced_at
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.filters),
+            "digest_users": len(self.modes),
+            "inactive_users": len(self.inactive),
+            "hits": self.hits,
+            "misses": self.misses,
+            "matched_posts": self.matched_posts,
+            "resyncs": self.resyncs,
+            "drift": self.drift,
+            "stream_events": self.stream_events,
+            "refreshed": self.refreshed,
+            "staleness": self.staleness(),
+        }
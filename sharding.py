@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from filters import PreparedText, compile_filters, prepare_text
+from matcher import MatchEngine, count_keys
+
+# Состояние процесса-шарда: свой MatchEngine с фильтрами только своих пользователей
+_engine = None
+
+
+def _init_shard(fuzzy_cutoff: int):
+    global _engine
+    _engine = MatchEngine(fuzzy_cutoff=fuzzy_cutoff, fuzzy_workers=1)
+
+
+def _update_shard(items: list) -> int:
+    _engine.set_many(items)
+    return len(_engine)
+
+
+def _reorder_shard(frequencies: dict) -> int:
+    return _engine.reorder(frequencies)
+
+
+def _match_shard(posts: list[tuple[str, dict]]) -> list[list[tuple[int, int]]]:
+    return [list(_engine.match_indices(_engine.prepare(text, fields)).items()) for text, fields in posts]
+
+
+class ShardedMatchEngine:
+    # Фильтры пользователей распределены по процессам (user_id % shards), каждый процесс
+    # держит свой шард в памяти. В шарды уходят текст поста и его поля, обратно - пары
+    # (user_id, номер фильтра), так что цикл событий не занят сопоставлением.
+    def __init__(self, shards: int, fuzzy_cutoff: int = 80, compiled_cache_size: int = 10000):
+        context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_shard,
+                initargs=(fuzzy_cutoff,)
+            )
+            for _ in range(shards)
+        ]
+        self.filters: dict[int, list] = {}
+        self.compiled_cache_size = compiled_cache_size
+        self._compiled: OrderedDict = OrderedDict()
+        self.shard_sizes = [0] * shards
+        # Ключи фильтров для статистики частот считаются здесь, шарды присылают только совпадения
+        self.vocabulary: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.filters)
+
+    def shard_of(self, user_id: int) -> int:
+        return user_id % len(self.executors)
+
+    def set_many(self, items):
+        # Обновления уходят только в шард-владелец; процесс шарда один, порядок сохраняется
+        by_shard: dict[int, list] = {}
+        for user_id, filters_list in items:
+            previous = self.filters.get(user_id)
+            if previous:
+                count_keys(self.vocabulary, compile_filters(previous), -1)
+            if filters_list:
+                self.filters[user_id] = filters_list
+                count_keys(self.vocabulary, compile_filters(filters_list), 1)
+            else:
+                self.filters.pop(user_id, None)
+            self._compiled.pop(user_id, None)
+            by_shard.setdefault(self.shard_of(user_id), []).append((user_id, filters_list))
+        for shard, batch in by_shard.items():
+            future = self.executors[shard].submit(_update_shard, batch)
+            future.add_done_callback(lambda f, shard=shard: self._updated(shard, f))
+
+    def _updated(self, shard: int, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            print(f"Ошибка обновления шарда {shard}: {future.exception()}")
+        else:
+            self.shard_sizes[shard] = future.result()
+
+    def reorder(self, frequencies: dict[str, float]):
+        for shard, executor in enumerate(self.executors):
+            future = executor.submit(_reorder_shard, frequencies)
+            future.add_done_callback(lambda f, shard=shard: self._reordered(shard, f))
+
+    def _reordered(self, shard: int, future):
+        if not future.cancelled() and future.exception():
+            print(f"Ошибка пересчёта порядка групп в шарде {shard}: {future.exception()}")
+
+    def set_user_filters(self, user_id: int, filters_list: list):
+        self.set_many([(user_id, filters_list)])
+
+    def remove_user(self, user_id: int):
+        self.set_many([(user_id, None)])
+
+    def prepare(self, text: str, fields: dict | None = None) -> PreparedText:
+        return prepare_text(text, fields=fields)
+
+    def _compiled_filter(self, user_id: int, fi: int):
+        compiled = self._compiled.get(user_id)
+        if compiled is None:
+            filters_list = self.filters.get(user_id)
+            if not filters_list:
+                return None
+            compiled = compile_filters(filters_list)
+            self._compiled[user_id] = compiled
+            if len(self._compiled) > self.compiled_cache_size:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(user_id)
+        # Фильтры могли измениться, пока шард считал
+        return compiled[fi] if fi < len(compiled) else None
+
+    async def match_batch(self, prepared_list: list[PreparedText]) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        posts = [(prepared.text, prepared.fields) for prepared in prepared_list]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, _match_shard, posts)
+            for executor in self.executors
+        ))
+        merged = [{} for _ in posts]
+        for shard_result in results:
+            for matches, pairs in zip(merged, shard_result):
+                for user_id, fi in pairs:
+                    user_filter = self._compiled_filter(user_id, fi)
+                    if user_filter is not None:
+                        matches[user_id] = user_filter
+        return merged
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_match_engine(backend: str, shards: int, fuzzy_cutoff: int = 80, fuzzy_workers: int = -1):
+    if backend == "sharded":
+        return ShardedMatchEngine(shards, fuzzy_cutoff=fuzzy_cutoff)
+    return MatchEngine(fuzzy_cutoff=fuzzy_cutoff, fuzzy_workers=fuzzy_workers)
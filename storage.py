@@ -0,0 +1,110 @@
+import datetime
+import zlib
+from pymongo.errors import BulkWriteError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("zlib", "zstd")
+
+
+def compress(text: str, codec: str) -> bytes:
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 9)
+
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(bytes(data)).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+class PostStore:
+    # Пост хранится в двух местах:
+    #  posts      - постоянная минимальная запись (channel_id, message_id, подпись) для дедупликации,
+    #               опционально сжатый текст, который хранится archive_days дней;
+    #  post_texts - полный текст для сопоставления и подбора из истории, удаляется TTL-индексом.
+    def __init__(self, posts_col, texts_col, codec: str | None = None, archive_days: int = 0):
+        if codec == "zstd" and zstandard is None:
+            print("Пакет zstandard не установлен, тексты сжимаются zlib")
+            codec = "zlib"
+        self.posts_col = posts_col
+        self.texts_col = texts_col
+        self.codec = codec if codec in CODECS else None
+        self.archive_days = archive_days
+        self.archived = 0
+        self.stripped = 0
+
+    def record(self, post) -> dict:
+        doc = post.to_document()
+        if self.codec:
+            doc["text_z"] = compress(post.text, self.codec)
+            doc["codec"] = self.codec
+        return doc
+
+    async def save_texts(self, posts: list, records: list[dict]):
+        docs = []
+        for post, record in zip(posts, records):
+            doc = {
+                "channel_id": post.channel_id,
+                "channel_username": post.channel_username,
+                "channel_title": post.channel_title,
+                "message_id": post.message_id,
+                "text": post.text,
+                "processed_at": record["processed_at"],
+            }
+            if post.cluster:
+                doc["cluster"] = list(post.cluster)
+            docs.append(doc)
+        if not docs:
+            return
+        try:
+            await self.texts_col.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Повторная вставка после сбоя: текст уже сохранён
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if errors:
+                print(f"Не удалось сохранить тексты постов: {errors[0].get('errmsg')}")
+
+    async def get_text(self, channel_id: int, message_id: int) -> str | None:
+        key = {"channel_id": channel_id, "message_id": message_id}
+        doc = await self.texts_col.find_one(key, {"text": 1})
+        if doc and doc.get("text"):
+            return doc["text"]
+        doc = await self.posts_col.find_one(key, {"text": 1, "text_z": 1, "codec": 1})
+        if not doc:
+            return None
+        if doc.get("text_z"):
+            return decompress(doc["text_z"], doc.get("codec", "zlib"))
+        return doc.get("text")
+
+    async def purge(self, text_ttl_days: int) -> tuple[int, int]:
+        # Сжатый текст живёт archive_days; старые записи с полным текстом в posts
+        # (до разделения коллекций) ужимаются до минимальной записи после TTL текстов
+        now = datetime.datetime.utcnow()
+        archived = stripped = 0
+        if self.archive_days:
+            result = await self.posts_col.update_many(
+                {"text_z": {"$exists": True},
+                 "processed_at": {"$lt": now - datetime.timedelta(days=self.archive_days)}},
+                {"$unset": {"text_z": "", "codec": ""}}
+            )
+            archived = result.modified_count
+        if text_ttl_days:
+            result = await self.posts_col.update_many(
+                {"text": {"$exists": True},
+                 "processed_at": {"$lt": now - datetime.timedelta(days=text_ttl_days)}},
+                {"$unset": {"text": "", "channel_username": "", "channel_title": ""}}
+            )
+            stripped = result.modified_count
+        self.archived += archived
+        self.stripped += stripped
+        return archived, stripped
+
+    def stats(self) -> dict:
+        return {"codec": self.codec or "none", "archive_days": self.archive_days,
+                "archived": self.archived, "stripped": self.stripped}
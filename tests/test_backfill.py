@@ -0,0 +1,12 @@
+from backfill import text_search
+
+
+def test_phrase_words_searched_separately():
+    # "machine learning" в кавычках требовал бы фразу в каждом посте и отсекал посты с python
+    assert text_search([["python", "machine learning"]]) == "python machine learning"
+
+
+def test_no_narrowing_for_fuzzy_or_conditions():
+    assert text_search([["~питон"]]) is None
+    assert text_search([["format=remote"], ["офис"]]) == "офис"
+    assert text_search([["format=remote"]]) is None
@@ -0,0 +1,11 @@
+from dedup import NearDuplicateIndex
+
+
+def test_recipients_expire_without_find():
+    # Воркер только записывает получателей: старые записи должны уходить сами
+    index = NearDuplicateIndex(window=10)
+    for t in range(100):
+        index.remember(("channel", t), {1}, float(t))
+    assert len(index.recipients) == 11
+    assert ("channel", 99) in index.recipients
+    assert ("channel", 0) not in index.recipients
@@ -0,0 +1,21 @@
+from digest import MESSAGE_LENGTH, render_digest
+
+
+def item(i: int, title: str = "Канал") -> dict:
+    return {"link": f"https://t.me/jobs/{i}", "title": title, "preview": "Python разработчик " + "x" * 60}
+
+
+def test_digest_fits_message_limit():
+    doc = {"items": [item(i, "Очень длинное название канала " * 10) for i in range(50)], "total": 120}
+    text = render_digest(doc, limit=50)
+    assert len(text) <= MESSAGE_LENGTH
+    shown = text.count("•")
+    # Свежие вакансии важнее: последняя строка - последний элемент
+    assert "https://t.me/jobs/49" in text
+    assert text.endswith(f"…и ещё {120 - shown}")
+
+
+def test_short_digest_unchanged():
+    text = render_digest({"items": [item(1), item(2)], "total": 2})
+    assert text.count("•") == 2
+    assert "и ещё" not in text
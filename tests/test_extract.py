@@ -0,0 +1,61 @@
+import pytest
+from extract import Predicate, extract_salary, looks_like_predicate, parse_predicate
+from filters import prepare_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("от 250 000 ₽", {"currency": "RUB", "min": 250000}),
+    ("80-120k", {"currency": "RUB", "min": 80000, "max": 120000}),
+    ("$3000-4000", {"currency": "USD", "min": 3000, "max": 4000}),
+    ("до 200к", {"currency": "RUB", "max": 200000}),
+    ("Up to $5000", {"currency": "USD", "max": 5000}),
+    ("150 000 руб.", {"currency": "RUB", "min": 150000, "max": 150000}),
+    ("опыт 3 года", None),
+    ("от 5 лет", None),
+])
+def test_extract_salary(text, expected):
+    assert extract_salary(text) == expected
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("salary>=150k", ("salary", ">=", 150000, "RUB")),
+    ("зп<=3000$", ("salary", "<=", 3000, "USD")),
+    ("format=remote", ("format", "=", "remote", None)),
+    ("формат=удаленка", ("format", "=", "remote", None)),
+    ("level=senior", ("seniority", "=", "senior", None)),
+    ("stack=python", ("stack", "=", "python", None)),
+])
+def test_parse_predicate(word, expected):
+    predicate = parse_predicate(word)
+    assert (predicate.field, predicate.op, predicate.value, predicate.currency) == expected
+
+
+@pytest.mark.parametrize("word", ["stack=cobol", "level>=senior", "format=somewhere"])
+def test_invalid_predicate(word):
+    # Похоже на условие, но не разбирается: бот переспросит пользователя
+    assert looks_like_predicate(word)
+    assert parse_predicate(word) is None
+
+
+def test_plain_word_is_not_predicate():
+    assert not looks_like_predicate("python")
+    assert not looks_like_predicate("foo=bar")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Python, удаленно, senior", {"format": ["remote"], "seniority": ["senior"], "stack": ["python"]}),
+    ("Работа не удаленно, офис", {"format": ["office"]}),
+    ("Middle Go developer гибрид", {"seniority": ["middle"], "format": ["hybrid"], "stack": ["go"]}),
+])
+def test_extract_fields(text, expected):
+    assert prepare_text(text).fields == expected
+
+
+def test_salary_predicate_ranges():
+    at_least = Predicate("salary", ">=", 150000, "RUB")
+    assert at_least.matches({"salary": {"currency": "RUB", "min": 100000, "max": 200000}})
+    assert not at_least.matches({"salary": {"currency": "RUB", "max": 120000}})
+    assert not at_least.matches({"salary": {"currency": "USD", "min": 5000}})
+    at_most = Predicate("salary", "<=", 100000, "RUB")
+    assert at_most.matches({"salary": {"currency": "RUB", "min": 80000}})
+    assert not at_most.matches({})
@@ -0,0 +1,63 @@
+import pytest
+from filters import compile_filters, fold, format_group, highlight, parse_group, prepare_text, stem, tokenize
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("офис", "офис"),
+    ("офисе", "офис"),
+    ("разработчика", "разработчик"),
+    ("удалённо", "удален"),
+    ("удаленно", "удален"),
+    ("developers", "developer"),
+])
+def test_stem(word, expected):
+    assert stem(fold(word)) == expected
+
+
+def test_tokenize_splits_compounds_and_keeps_tech_names():
+    assert tokenize("Full-Stack разработчик C++/C#, Node.js") == ["full", "stack", "разработчик", "c++", "c#", "node.js"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("работа в офисе", True),
+    ("офисный планктон", False),
+])
+def test_word_forms(text, expected):
+    assert compile_filters([[["офис"]]])[0].matches(prepare_text(text)) is expected
+
+
+def test_phrase_matches_across_hyphen():
+    user_filter = compile_filters([[["full stack"]]])[0]
+    assert user_filter.matches(prepare_text("Ищем full-stack разработчика"))
+    assert not user_filter.matches(prepare_text("full time, stack: python"))
+
+
+def test_exclusions():
+    user_filter = compile_filters([[["python"], ["-senior"], ["-format=office"]]])[0]
+    assert user_filter.matches(prepare_text("python junior, удаленно"))
+    assert not user_filter.matches(prepare_text("python senior"))
+    assert not user_filter.matches(prepare_text("python, работа в офисе"))
+
+
+def test_highlight_escapes_html():
+    user_filter = compile_filters([[["python"], ["разработчик"]]])[0]
+    assert highlight("Ищем Python разработчика <срочно>", user_filter) == \
+        "Ищем <b>Python</b> <b>разработчика</b> &lt;срочно&gt;"
+
+
+@pytest.mark.parametrize("item, fuzzy, expected", [
+    ("python|go", False, ["python", "go"]),
+    ("python|go", True, ["~python", "~go"]),
+    ("-senior|lead", False, ["-senior", "-lead"]),
+    ("-senior|lead", True, ["-senior", "-lead"]),
+    ("python||go", False, None),
+    ("-", False, None),
+    ("python|-go", False, None),
+])
+def test_parse_group(item, fuzzy, expected):
+    assert parse_group(item, fuzzy) == expected
+
+
+@pytest.mark.parametrize("item", ["python|go", "-senior|lead", "офис"])
+def test_format_group_round_trip(item):
+    assert format_group(parse_group(item)) == item
@@ -0,0 +1,67 @@
+import random
+import pytest
+from benchmarks.synthetic import generate_posts
+from matcher import MatchEngine
+
+WORDS = ["python", "go", "java", "fullstack", "без опыта", "team lead", "удалённо", "офис",
+         "senior", "junior", "middle", "django", "kafka", "разработчик", "developer", "react"]
+CONDITIONS = ["format=remote", "level=senior", "stack=go", "salary>=150k", "salary<=100k"]
+
+
+def random_filters(users: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    filters = {}
+    for user_id in range(users):
+        filters_list = []
+        for _ in range(rng.randint(1, 3)):
+            groups = [rng.sample(WORDS, rng.randint(1, 2)) for _ in range(rng.randint(1, 3))]
+            if rng.random() < 0.3:
+                groups.append([rng.choice(CONDITIONS)])
+            if rng.random() < 0.3:
+                groups.append(["-" + rng.choice(WORDS + CONDITIONS)])
+            filters_list.append(groups)
+        filters[user_id] = filters_list
+    return filters
+
+
+def brute_force(engine: MatchEngine, prepared) -> dict:
+    result = {}
+    for user_id, compiled in engine.user_filters.items():
+        for fi, user_filter in enumerate(compiled):
+            if user_filter.matches(prepared):
+                result[user_id] = fi
+                break
+    return result
+
+
+@pytest.mark.parametrize("skewed", [False, True])
+def test_index_matches_brute_force(skewed):
+    engine = MatchEngine()
+    engine.set_many(random_filters(300, seed=1).items())
+    if skewed:
+        # Одни слова «частые», другие «редкие»: фильтры индексируются по одной группе
+        rng = random.Random(2)
+        engine.reorder({key: rng.random() for key in engine.vocabulary})
+        assert engine.verify
+    posts = generate_posts(300, seed=3) + ["Ищем Python разработчика full stack, можно без опыта, удалённо"]
+    for text in posts:
+        prepared = engine.prepare(text)
+        assert engine.match_indices(prepared) == brute_force(engine, prepared)
+
+
+def test_phrase_in_unindexed_group():
+    engine = MatchEngine()
+    engine.reorder({"python": 0.01, "fullstack": 0.5, "full stack": 0.5, "фулстек": 0.5})
+    engine.set_user_filters(1, [[["python"], ["fullstack"]]])
+    assert 1 in engine.match("Ищем Python разработчика full stack")
+
+
+def test_max_phrase_shrinks_after_remove():
+    engine = MatchEngine()
+    engine.set_user_filters(1, [[["team lead"]]])
+    engine.set_user_filters(2, [[["python"]]])
+    engine.prepare("x")
+    assert engine.max_phrase == 2
+    engine.remove_user(1)
+    engine.prepare("x")
+    assert engine.max_phrase == 1
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+from benchmarks.fake_api import FakeBotApi
+from updates import OrderedApplication
+
+
+def private_message(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": str(update_id),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+    }}
+
+
+def channel_post(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "channel_post": {
+        "message_id": update_id, "date": 0, "text": str(update_id),
+        "chat": {"id": chat_id, "type": "channel"},
+    }}
+
+
+async def run_updates(raw_updates: list[dict], slow_chat: int, concurrent: int = 2) -> dict:
+    api = await FakeBotApi().start(port=0)
+    port = api._server.sockets[0].getsockname()[1]
+    app = (ApplicationBuilder().token("1:test").base_url(f"http://127.0.0.1:{port}/bot")
+           .application_class(OrderedApplication).concurrent_updates(concurrent).updater(None).build())
+    done = {}
+
+    async def handle(update: Update, context):
+        if update.effective_chat.id == slow_chat:
+            await asyncio.sleep(0.2)
+        done[update.update_id] = time.monotonic()
+
+    app.add_handler(TypeHandler(Update, handle))
+    await app.initialize()
+    await app.start()
+    started = time.monotonic()
+    for raw in raw_updates:
+        await app.update_queue.put(Update.de_json(raw, app.bot))
+    while len(done) < len(raw_updates):
+        await asyncio.sleep(0.01)
+    await app.stop()
+    await app.shutdown()
+    await api.stop()
+    return {update_id: at - started for update_id, at in done.items()}
+
+
+def test_busy_chat_does_not_block_channel_posts():
+    # Пять медленных сообщений одного пользователя и пост канала при двух слотах:
+    # раньше ожидающие апдейты чата занимали оба слота и пост ждал почти секунду
+    updates = [private_message(i, chat_id=1) for i in range(1, 6)] + [channel_post(100, chat_id=-1001)]
+    done = asyncio.run(run_updates(updates, slow_chat=1))
+    assert done[100] < 0.15
+    assert sorted(range(1, 6), key=done.get) == [1, 2, 3, 4, 5]
+    assert done[5] >= 0.9
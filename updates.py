@@ -0,0 +1,88 @@
+import time
+from collections import Counter, deque
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+from metrics import Histogram
+
+
+def ordering_key(update: object) -> int | None:
+    # Посты каналов обрабатываются параллельно, всё остальное - по очереди в пределах чата
+    if not isinstance(update, Update):
+        return None
+    if update.channel_post or update.edited_channel_post:
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class OrderedApplication(Application):
+    # При concurrent_updates апдейты одного пользователя не должны обгонять друг друга,
+    # иначе ConversationHandler увидит ответы не в том состоянии. Апдейты чата встают в его очередь
+    # и сразу освобождают слот PTB; одна задача на чат берёт слот на каждый апдейт по очереди,
+    # поэтому поток сообщений одного чата не занимает слоты, нужные постам других каналов
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._chat_queues: dict[int, deque] = {}
+
+    async def process_update(self, update: object) -> None:
+        key = ordering_key(update)
+        if key is None:
+            return await super().process_update(update)
+
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return
+        self._chat_queues[key] = deque([update])
+        self.create_task(self._drain_chat(key))
+
+    async def _drain_chat(self, key: int):
+        queue = self._chat_queues[key]
+        try:
+            while queue:
+                update = queue.popleft()
+                try:
+                    async with self._concurrent_updates_sem:
+                        await super().process_update(update)
+                except Exception as e:
+                    # Ошибка одного апдейта не должна оставлять остальные апдейты чата без обработки
+                    print(f"Ошибка обработки апдейта чата {key}: {e}")
+        finally:
+            del self._chat_queues[key]
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # Время и исход каждого вызова Bot API с разбивкой по методам
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency: dict[str, Histogram] = {}
+        self.calls: Counter = Counter()
+        self.failures: Counter = Counter()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.monotonic()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            self.failures[api_method] += 1
+            raise
+        finally:
+            self.calls[api_method] += 1
+            histogram = self.latency.get(api_method)
+            if histogram is None:
+                histogram = self.latency[api_method] = Histogram()
+            histogram.observe(time.monotonic() - started)
+        if code >= 400:
+            self.failures[api_method] += 1
+        return code, payload
+
+    def stats(self) -> dict:
+        result = {"calls": dict(self.calls), "failures": dict(self.failures)}
+        for api_method, histogram in self.latency.items():
+            result[f"{api_method}_latency"] = histogram.snapshot()
+        return result
@@ -0,0 +1,329 @@
+import asyncio
+import datetime
+import math
+import time
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from dedup import NearDuplicateIndex
+from matcher import MatchEngine
+from metrics import errors
+from pipeline import IngestPipeline, IncomingPost
+from registry import SubscriberRegistry
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def shard_query(shard: int, shards: int, field: str = "chat_id") -> dict:
+    return {field: {"$mod": [shards, shard]}}
+
+
+class ShardLeases:
+    # Аренды в коллекции leases: {_id: "shard:N", owner, expires_at, checkpoint} на каждый шард
+    # и {_id: "worker:ID", expires_at} на каждый живой воркер. Срок сравнивается по часам воркеров,
+    # поэтому на машинах нужна синхронизация времени (NTP).
+    def __init__(self, leases_col, worker_id: str, shards: int, ttl: float = 30.0):
+        self.leases_col = leases_col
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl = ttl
+
+    def _expires(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+
+    async def heartbeat(self) -> int:
+        # Возвращает число живых воркеров, включая этот
+        await self.leases_col.update_one(
+            {"_id": f"worker:{self.worker_id}"},
+            {"$set": {"kind": "worker", "expires_at": self._expires()}},
+            upsert=True
+        )
+        return await self.leases_col.count_documents(
+            {"kind": "worker", "expires_at": {"$gt": datetime.datetime.utcnow()}}
+        )
+
+    async def acquire(self, shard: int) -> dict | None:
+        now = datetime.datetime.utcnow()
+        try:
+            return await self.leases_col.find_one_and_update(
+                {"_id": f"shard:{shard}",
+                 "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"kind": "shard", "owner": self.worker_id, "expires_at": self._expires()},
+                 # Новый шард начинает с текущих постов, историю не рассылаем
+                 "$setOnInsert": {"checkpoint": ObjectId.from_datetime(now)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Аренда существует и принадлежит другому живому воркеру
+            return None
+
+    async def renew(self, shard: int) -> bool:
+        result = await self.leases_col.update_one(
+            {"_id": f"shard:{shard}", "owner": self.worker_id},
+            {"$set": {"expires_at": self._expires()}}
+        )
+        return result.matched_count == 1
+
+    async def checkpoint(self, shard: int, post_id) -> bool:
+        result = await self.leases_col.update_one(
+            {"_id": f"shard:{shard}", "owner": self.worker_id},
+            {"$set": {"checkpoint": post_id}}
+        )
+        return result.matched_count == 1
+
+    async def release(self, shard: int):
+        await self.leases_col.update_one(
+            {"_id": f"shard:{shard}", "owner": self.worker_id},
+            {"$set": {"owner": None, "expires_at": EPOCH}}
+        )
+
+    async def leave(self):
+        await self.leases_col.delete_one({"_id": f"worker:{self.worker_id}"})
+
+
+class ShardRunner:
+    # Один шард пользователей: свой кэш фильтров и индекс, курсор по новым постам
+    # (checkpoint - _id последнего обработанного поста), совпадения идут в общий outbox и очередь рассылки
+    def __init__(self, worker, shard: int, checkpoint):
+        self.worker = worker
+        self.shard = shard
+        self.checkpoint = checkpoint
+        self.subscribers = SubscriberRegistry(
+            worker.users_col,
+            MatchEngine(**worker.engine_options),
+            shard=(shard, worker.leases.shards),
+            on_reactivated=worker.delivery_queue.unblock
+        )
+        self.pipeline = IngestPipeline(
+            worker.store,
+            self.subscribers,
+            worker.delivery_queue,
+            None,
+            NearDuplicateIndex(**worker.near_dup_options),
+            max_size=worker.batch_size,
+            digests=worker.digests,
+            outbox=worker.outbox
+        )
+        self._task = None
+        self.lost = False
+        self.posts = 0
+        self.deliveries = 0
+
+    async def start(self):
+        self.subscribers.reorder(self.worker.frequencies)
+        await self.subscribers.load()
+        # Блокировки, оставшиеся с прошлого владения шардом, для снова активных пользователей
+        for user_id in list(self.worker.delivery_queue.blocked):
+            if self.subscribers.owns(user_id) and user_id not in self.subscribers.inactive:
+                self.worker.delivery_queue.unblock(user_id)
+        # Рассылка, которую не закончил прежний владелец шарда
+        await self.worker.outbox.resume(
+            self.worker.delivery_queue, self.worker.store,
+            shard_query(self.shard, self.worker.leases.shards)
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        resynced = refreshed = time.monotonic()
+        while True:
+            try:
+                count = await self.step()
+                # Фильтры и режимы меняет приёмный процесс: подтягиваем их по updated_at,
+                # полная сверка - редкая страховка от пропусков
+                if time.monotonic() - resynced > self.worker.resync_interval:
+                    resynced = refreshed = time.monotonic()
+                    await self.subscribers.resync()
+                elif time.monotonic() - refreshed > self.worker.refresh_interval:
+                    refreshed = time.monotonic()
+                    await self.subscribers.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors["worker"] += 1
+                print(f"Ошибка обработки шарда {self.shard}: {e}")
+                count = 0
+            if self.lost:
+                return
+            if count < self.worker.batch_size:
+                await asyncio.sleep(self.worker.poll_interval)
+
+    async def step(self) -> int:
+        # Посты моложе settle секунд не читаем: пачка приёмного процесса могла быть записана не целиком
+        settled = ObjectId.from_datetime(
+            datetime.datetime.utcnow() - datetime.timedelta(seconds=self.worker.settle)
+        )
+        docs = await self.worker.store.posts_col.find(
+            {"_id": {"$gt": self.checkpoint, "$lt": settled}},
+            {"channel_id": 1, "message_id": 1, "signature": 1, "cluster": 1, "fields": 1}
+        ).sort("_id", 1).limit(self.worker.batch_size).to_list(None)
+        if not docs:
+            return 0
+
+        texts = {}
+        cursor = self.worker.store.texts_col.find(
+            {"channel_id": {"$in": list({doc["channel_id"] for doc in docs})},
+             "message_id": {"$in": list({doc["message_id"] for doc in docs})}},
+            {"channel_id": 1, "message_id": 1, "channel_username": 1, "channel_title": 1, "text": 1}
+        )
+        async for saved in cursor:
+            texts[(saved["channel_id"], saved["message_id"])] = saved
+
+        posts = []
+        for doc in docs:
+            saved = texts.get((doc["channel_id"], doc["message_id"]), {})
+            text = saved.get("text") or await self.worker.store.get_text(doc["channel_id"], doc["message_id"])
+            if not text:
+                continue
+            post = IncomingPost(doc["channel_id"], saved.get("channel_username"), saved.get("channel_title"),
+                                doc["message_id"], text)
+            post.signature = doc.get("signature")
+            post.cluster = tuple(doc["cluster"]) if doc.get("cluster") else None
+            post.prepared = self.subscribers.prepare(text, doc.get("fields"))
+            posts.append(post)
+
+        deliveries, digest_entries = await self.pipeline.match(posts)
+        await self.pipeline.enqueue(posts, deliveries, digest_entries)
+        self.posts += len(posts)
+        self.deliveries += len(deliveries)
+        # После сбоя до этой записи пачка сопоставится заново, outbox отбросит повторы
+        self.checkpoint = docs[-1]["_id"]
+        if not await self.worker.leases.checkpoint(self.shard, self.checkpoint):
+            self.lost = True
+        return len(docs)
+
+    def stats(self) -> dict:
+        return {"users": len(self.subscribers), "posts": self.posts, "deliveries": self.deliveries}
+
+
+class ShardWorker:
+    # Процесс-воркер: держит аренды на часть шардов пользователей (поровну между живыми воркерами),
+    # продлевает их каждые ttl/3 секунд и забирает шарды упавших воркеров
+    def __init__(self, leases: ShardLeases, users_col, store, delivery_queue, outbox, digests=None,
+                 engine_options: dict | None = None, near_dup_options: dict | None = None,
+                 batch_size: int = 100, poll_interval: float = 0.5, settle: float = 1.0,
+                 resync_interval: float = 600, refresh_interval: float = 5):
+        self.leases = leases
+        self.users_col = users_col
+        self.store = store
+        self.delivery_queue = delivery_queue
+        self.outbox = outbox
+        self.digests = digests
+        self.engine_options = engine_options or {}
+        self.near_dup_options = near_dup_options or {}
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.resync_interval = resync_interval
+        self.refresh_interval = refresh_interval
+        self.runners: dict[int, ShardRunner] = {}
+        self.frequencies: dict[str, float] = {}
+        self.live_workers = 0
+        self.acquired = 0
+        self.lost = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Аренды отпускаем после остановки рассылки и записи подтверждений:
+        # новый владелец возьмёт из outbox только то, что действительно не отправлено
+        shards = list(self.runners)
+        for shard in shards:
+            await self._drop(shard)
+        await self.delivery_queue.stop()
+        await self.outbox.flush()
+        for shard in shards:
+            await self.leases.release(shard)
+        await self.leases.leave()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.balance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors["leases"] += 1
+                print(f"Ошибка продления аренды шардов: {e}")
+            await asyncio.sleep(self.leases.ttl / 3)
+
+    async def balance(self):
+        self.live_workers = await self.leases.heartbeat()
+        target = math.ceil(self.leases.shards / max(1, self.live_workers))
+        for shard in list(self.runners):
+            if self.runners[shard].lost or not await self.leases.renew(shard):
+                self.lost += 1
+                print(f"Аренда шарда {shard} потеряна")
+                await self._drop(shard)
+        # Лишние шарды отдаём по одному за проход, новым воркерам достаются освободившиеся
+        if len(self.runners) > target:
+            shard = max(self.runners)
+            await self.handoff(shard)
+        for shard in range(self.leases.shards):
+            if len(self.runners) >= target:
+                break
+            if shard in self.runners:
+                continue
+            lease = await self.leases.acquire(shard)
+            if lease:
+                runner = self.runners[shard] = ShardRunner(self, shard, lease["checkpoint"])
+                await runner.start()
+                self.acquired += 1
+                print(f"Шард {shard} из {self.leases.shards} закреплён за воркером {self.leases.worker_id}")
+
+    async def handoff(self, shard: int):
+        # Новый владелец поднимет незавершённую рассылку из outbox; ждём, пока свои
+        # доставки шарда уйдут и подтвердятся, чтобы не отправить их дважды
+        await self._drop(shard)
+        deadline = time.monotonic() + self.leases.ttl / 3
+        query = shard_query(shard, self.leases.shards)
+        while time.monotonic() < deadline:
+            await self.outbox.flush()
+            # Упавшие после всех повторов записи ждать бессмысленно: их повторит новый владелец
+            if not await self.outbox.outbox_col.find_one({**query, "failed_at": {"$exists": False}}, {"_id": 1}):
+                break
+            await asyncio.sleep(self.outbox.flush_interval)
+        await self.leases.release(shard)
+
+    async def _drop(self, shard: int):
+        runner = self.runners.pop(shard, None)
+        if runner:
+            await runner.stop()
+
+    def reorder(self, frequencies: dict[str, float]):
+        self.frequencies = frequencies
+        for runner in self.runners.values():
+            runner.subscribers.reorder(frequencies)
+
+    async def deactivate(self, user_id: int):
+        runner = self.runners.get(user_id % self.leases.shards)
+        if runner:
+            await runner.subscribers.deactivate(user_id)
+        else:
+            now = datetime.datetime.utcnow()
+            await self.users_col.update_one(
+                {"user_id": user_id},
+                {"$set": {"active": False, "deactivated_at": now, "updated_at": now}}
+            )
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.leases.worker_id,
+            "live_workers": self.live_workers,
+            "shards": len(self.runners),
+            "acquired": self.acquired,
+            "lost": self.lost,
+            **{f"shard_{shard}": runner.stats() for shard, runner in sorted(self.runners.items())},
+        }